@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CHUNK_SIZE, COLUMNS, DTYPES, load_cached, read_interval_chunks
+
+# Benchmark of loading, splitting, statistics and every chart with synthetic logs of different sizes:
+#   python benchmark.py --sizes 1000 100000 10000000 --out bench.json
+#   python benchmark.py --sizes 1000 100000 --out new.json --compare bench.json
+# Every size runs in a new process so the peak memory (RSS) of one size doesn't hide the next one.
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+RESET_PATTERNS = ['even', 'random', 'skewed']
+
+
+def interval_starts(rows: int, intervals: int, pattern: str, rng) -> np.ndarray:
+    # First row of every interval.
+    # pattern says how long the intervals are: all the same (even), random, or one very long and the rest short (skewed)
+    intervals = max(1, min(intervals, rows))
+    if pattern == 'even':
+        return np.linspace(0, rows, intervals, endpoint=False).astype(np.int64)
+    if pattern == 'random':
+        return np.sort(np.concatenate(([0], rng.choice(np.arange(1, rows), intervals - 1, replace=False))))
+    if pattern == 'skewed':
+        return np.concatenate(([0], rows - intervals + np.arange(1, intervals)))
+    raise ValueError('Unknown reset pattern: {}'.format(pattern))
+
+
+def synthetic_chunks(rows: int, intervals: int = 3, pattern: str = 'even', seed: int = 0, chunksize: int = CHUNK_SIZE):
+    # Random data with the same columns and ranges as microbit_sensor.csv, chunksize rows at a time
+    rng = np.random.default_rng(seed)
+    starts = interval_starts(rows, intervals, pattern, rng)
+    for first in range(0, rows, chunksize):
+        positions = np.arange(first, min(first + chunksize, rows))
+        n = len(positions)
+        # The sample-id starts again at 0 in every interval
+        sample_id = positions - starts[np.searchsorted(starts, positions, side='right') - 1]
+        yield pd.DataFrame({
+            'Time (seconds)': np.round(sample_id * 30 + rng.uniform(0, 5, n), 2),
+            'sample-id': sample_id,
+            'temp': rng.integers(24, 35, n),
+            'light': rng.integers(0, 256, n),
+            'sound-level': rng.integers(0, 200, n),
+            'acc-x': rng.integers(-2048, 2048, n),
+            'acc-y': rng.integers(-2048, 2048, n),
+            'acc-z': rng.integers(-2048, 2048, n),
+            'compass-heading': rng.integers(0, 360, n),
+        }, columns=COLUMNS).astype(DTYPES)
+
+
+def write_synthetic_csv(path: str, rows: int, intervals: int = 3, pattern: str = 'even', seed: int = 0):
+    # Runs in its own process before the measured one, and only one chunk is in memory
+    with open(path, 'w', newline='') as file:
+        for number, chunk in enumerate(synthetic_chunks(rows, intervals, pattern, seed)):
+            chunk.to_csv(file, index=False, header=number == 0)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kilobytes and macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(stages: dict, name: str, rows: int, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    stages[name] = {'seconds': seconds, 'rows_per_second': rows / seconds if seconds > 0 else None}
+    return result
+
+
+def run_size(path: str, rows: int, charts: bool, max_points: int) -> dict:
+    # Runs in its own process, the CSV was written by another one so the peak memory is only the analysis
+    import matplotlib.pyplot as plt
+    import main
+    from bin_index import build_bin_index
+    from interval_stats import compute_stats
+    from query import SensorLog
+    from rollups import build_rollups
+
+    stages = {}
+    folder = os.path.dirname(path)
+    cache_dir = os.path.join(folder, 'cache')
+
+    # The chunks are only counted, like a pass over the file that doesn't keep it
+    timed(stages, 'parse_csv', rows, lambda: sum(len(chunk) for chunk in read_interval_chunks(path)))
+    timed(stages, 'cache_cold', rows, load_cached, path, cache_dir)
+    dataframe = timed(stages, 'cache_warm', rows, load_cached, path, cache_dir)
+    list_of_intervals = timed(stages, 'split_intervals', rows, main.split_intervals, dataframe)
+    stats = timed(stages, 'compute_stats', rows, compute_stats, dataframe)
+    bins = timed(stages, 'bin_index', rows, build_bin_index, dataframe)
+    rollups = timed(stages, 'rollups', rows, build_rollups, dataframe)
+
+    if charts:
+        # The charts use the module state of main, so it points to the synthetic data
+        plt.switch_backend('Agg')
+        main.CHARTS_DIR = os.path.join(folder, 'charts')
+        os.makedirs(main.CHARTS_DIR)
+        main.SHOW_CHARTS = False
+        main.FIGURES.enabled = True
+        main.MAX_POINTS = max_points
+        main.DATA = SensorLog(path, cache_dir, frame=dataframe)
+        main.DATA.stats = stats
+        main.DATA.bins = bins
+        main.DATA.rollups = rollups
+        for name, function in main.CHARTS.items():
+            timed(stages, 'chart_' + name, rows, function, list_of_intervals)
+
+    return {'rows': rows, 'intervals': len(list_of_intervals), 'stages': stages, 'peak_rss_mb': peak_rss_mb()}
+
+
+def version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def compare(results: dict, baseline: dict):
+    # Time of every stage against the baseline, a ratio above 1 means it got slower
+    old = {(item['rows'], item['reset_pattern']): item for item in baseline['results']}
+    print('Compared with {}'.format(baseline['version']))
+    for item in results['results']:
+        before = old.get((item['rows'], item['reset_pattern']))
+        if before is None:
+            continue
+        for stage, values in item['stages'].items():
+            if stage in before['stages']:
+                ratio = values['seconds'] / max(before['stages'][stage]['seconds'], 1e-9)
+                flag = '  <-- slower' if ratio > 1.2 else ''
+                print('{:>10} {:<32} {:6.2f}x{}'.format(item['rows'], stage, ratio, flag))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark of the Micro:bit analysis')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='number of rows of each synthetic log')
+    parser.add_argument('--intervals', type=int, default=3)
+    parser.add_argument('--pattern', choices=RESET_PATTERNS, default='even', help='length of the intervals')
+    parser.add_argument('--no-charts', action='store_true', help='only time the load and the statistics')
+    parser.add_argument('--max-points', type=int, default=None, help='decimation of the time series charts')
+    parser.add_argument('--out', default='benchmark.json', help='JSON file with the results')
+    parser.add_argument('--compare', metavar='JSON', default=None, help='results of a previous version')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {'version': version(), 'python': platform.python_version(), 'platform': platform.platform(),
+               'numpy': np.__version__, 'pandas': pd.__version__, 'results': []}
+    for rows in args.sizes:
+        # A new process to write the CSV and another one for every size (spawn, so they don't inherit the memory of this one)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'microbit_sensor.csv')
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                executor.submit(write_synthetic_csv, path, rows, args.intervals, args.pattern).result()
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                item = executor.submit(run_size, path, rows, not args.no_charts, args.max_points).result()
+        item['reset_pattern'] = args.pattern
+        results['results'].append(item)
+        print('{:>10} rows, {} intervals, peak RSS {:.0f} MB'.format(rows, item['intervals'], item['peak_rss_mb']))
+        for stage, values in item['stages'].items():
+            print('    {:<32} {:8.3f}s'.format(stage, values['seconds']))
+    with open(args.out, 'w') as file:
+        json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
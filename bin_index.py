@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import interval_bounds
+
+# Counts of the light, sound and compass charts built once when the data is loaded,
+# so the charts are drawn from a few hundred integers per interval instead of all the rows
+
+LIGHT_LABELS = ['Dark', 'Light']
+# Same bins as the light chart: [0, 150) is dark and [150, 300) is light
+LIGHT_EDGES = np.linspace(0, 300, 3)
+# One bin for every dB value, any histogram of the sound can be made from these counts
+SOUND_LEVELS = 256
+COMPASS_LABELS = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+# The first sector is from -22.5 to 22.5 degrees (N)
+COMPASS_EDGES = np.linspace(-22.5, 360 - 22.5, 9)
+
+
+def light_codes(light) -> np.ndarray:
+    # 0 for dark, 1 for light and -1 for values out of the bins (right=False like the chart)
+    codes = np.digitize(light, LIGHT_EDGES, right=False) - 1
+    codes[codes >= len(LIGHT_LABELS)] = -1
+    return codes
+
+
+def compass_codes(heading) -> np.ndarray:
+    # Headings after 337.5 degrees are in the first sector (N) again
+    codes = np.digitize(np.mod(heading, 360), COMPASS_EDGES, right=True) - 1
+    codes[codes == len(COMPASS_LABELS)] = 0
+    return codes
+
+
+def _count(codes: np.ndarray, segments: np.ndarray, n_segments: int, n_bins: int) -> np.ndarray:
+    # Counts of every (segment, bin) pair with a single bincount
+    valid = (codes >= 0) & (codes < n_bins)
+    flat = np.bincount(segments[valid] * n_bins + codes[valid], minlength=n_segments * n_bins)
+    return flat.reshape(n_segments, n_bins)
+
+
+class BinIndex:
+    def __init__(self, keys: list, light: np.ndarray, sound: np.ndarray, compass: np.ndarray):
+        # keys identify each row of counts, the interval number or a (device, interval) pair for example
+        self.keys = list(keys)
+        self.light = light
+        self.sound = sound
+        self.compass = compass
+        self._positions = {key: position for position, key in enumerate(self.keys)}
+
+    def light_counts(self, key) -> pd.Series:
+        return pd.Series(self.light[self._positions[key]], index=LIGHT_LABELS)
+
+    def sound_counts(self, key) -> np.ndarray:
+        return self.sound[self._positions[key]]
+
+    def compass_counts(self, key) -> pd.Series:
+        return pd.Series(self.compass[self._positions[key]], index=COMPASS_LABELS)
+
+    def with_prefix(self, prefix) -> 'BinIndex':
+        # Same counts with (prefix, key) keys, used to merge the indexes of several files
+        return BinIndex([(prefix, key) for key in self.keys], self.light, self.sound, self.compass)
+
+    def merge(self, other: 'BinIndex') -> 'BinIndex':
+        # The counts of the keys that are in both indexes are added
+        positions = dict(self._positions)
+        for key in other.keys:
+            positions.setdefault(key, len(positions))
+        other_positions = [positions[key] for key in other.keys]
+        merged = []
+        for name in ['light', 'sound', 'compass']:
+            counts = np.zeros((len(positions), getattr(self, name).shape[1]), dtype=np.int64)
+            counts[:len(self.keys)] = getattr(self, name)
+            np.add.at(counts, other_positions, getattr(other, name))
+            merged.append(counts)
+        return BinIndex(list(positions), *merged)
+
+    def combined(self, key='All') -> 'BinIndex':
+        # All the rows added together
+        return BinIndex([key], self.light.sum(axis=0, keepdims=True), self.sound.sum(axis=0, keepdims=True),
+                        self.compass.sum(axis=0, keepdims=True))
+
+
+def build_bin_index(dataframe: pd.DataFrame) -> BinIndex:
+    interval_numbers = dataframe['interval'].to_numpy()
+    if len(interval_numbers) == 0:
+        return BinIndex([], np.zeros((0, len(LIGHT_LABELS)), dtype=np.int64), np.zeros((0, SOUND_LEVELS), dtype=np.int64),
+                        np.zeros((0, len(COMPASS_LABELS)), dtype=np.int64))
+    bounds = interval_bounds(interval_numbers)
+    starts, lengths = bounds[:-1], np.diff(bounds)
+    # Position of the interval of every row
+    segments = np.repeat(np.arange(len(starts)), lengths)
+    keys = [int(number) for number in interval_numbers[starts]]
+    sound = np.clip(dataframe['sound-level'].to_numpy(), 0, SOUND_LEVELS - 1).astype(np.int64)
+    return BinIndex(
+        keys,
+        _count(light_codes(dataframe['light'].to_numpy()), segments, len(keys), len(LIGHT_LABELS)),
+        _count(sound, segments, len(keys), SOUND_LEVELS),
+        _count(compass_codes(dataframe['compass-heading'].to_numpy()), segments, len(keys), len(COMPASS_LABELS)),
+    )
@@ -0,0 +1,447 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Reading the micro:bit logs without loading the whole file in memory
+
+CSV_PATH = 'data/microbit_sensor.csv'
+# The typed frame is saved here as one binary file so it can be memory-mapped
+CACHE_DIR = 'data/.cache'
+# Version of the cache files, the caches of other versions are built again
+CACHE_FORMAT = 5
+# Number of rows read on each step, the memory used depends on this and not on the size of the file
+CHUNK_SIZE = 100_000
+# Bytes read from the file at once, the lines are cut into chunks of CHUNK_SIZE rows after that
+BLOCK_SIZE = 1 << 22
+# The rows that can't be read are saved here (in the folder of the cache) with the reason
+QUARANTINE_FILE = 'quarantine.csv'
+
+# The micro:bit values fit in much smaller types than the int64/float64 that pandas uses by default.
+# For every column: the type used in memory and the minimum and maximum value (None means no limit)
+SCHEMA = {
+    'Time (seconds)': (np.float32, 0, None),
+    'sample-id': (np.int32, 0, None),
+    'temp': (np.int8, -128, 127),
+    'light': (np.uint8, 0, 255),
+    'sound-level': (np.uint8, 0, 255),
+    'acc-x': (np.int16, -32768, 32767),
+    'acc-y': (np.int16, -32768, 32767),
+    'acc-z': (np.int16, -32768, 32767),
+    'compass-heading': (np.uint16, 0, 359),
+}
+DTYPES = {column: dtype for column, (dtype, _, _) in SCHEMA.items()}
+COLUMNS = list(SCHEMA)
+# The CSV is parsed with wider types, read_csv would silently wrap a value like 300 into an uint8
+PARSE_DTYPES = {column: np.float32 if np.issubdtype(dtype, np.floating) else np.int32 for column, dtype in DTYPES.items()}
+# Columns with the values of the sensors (the others are the time and the sample counter)
+SENSORS = ['temp', 'light', 'sound-level', 'acc-x', 'acc-y', 'acc-z', 'compass-heading']
+
+
+def interval_bounds(interval_numbers) -> np.ndarray:
+    # The rows of an interval are always together, so the intervals start where the number changes.
+    # Returns the start of every interval and the length of the data at the end
+    interval_numbers = np.asarray(interval_numbers)
+    return np.concatenate(([0], np.flatnonzero(interval_numbers[1:] != interval_numbers[:-1]) + 1, [len(interval_numbers)]))
+
+
+class Quarantine:
+    # Rows of the CSV that were left out, with their line number, the reason and the text of the line.
+    # If path is None the rows are only counted
+    def __init__(self, path: str = None):
+        self.path = path
+        self.counts = {}
+        self._file = None
+        self._writer = None
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, lines: np.ndarray, reasons: np.ndarray, texts: list):
+        for reason, count in zip(*np.unique(reasons, return_counts=True)):
+            # The counts are by kind of error, without the number of fields
+            kind = re.sub(r' \(expected .*\)$', '', reason)
+            self.counts[kind] = self.counts.get(kind, 0) + int(count)
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(['line', 'reason', 'row'])
+        self._writer.writerows(zip(lines.tolist(), reasons.tolist(), texts))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def validate(chunk: pd.DataFrame) -> tuple:
+    # Check every column at once and convert it to the type of the schema.
+    # Returns the valid rows and, for every row, the reason it is not valid ('' if it is) and whether its sample-id
+    # is a valid 0 (a reset that counts even if another value of the row is bad)
+    # Every row keeps the first reason found, as a position in the list of messages (0 is a valid row)
+    messages = ['']
+    codes = np.zeros(len(chunk), dtype=np.int16)
+
+    def reject(mask: np.ndarray, reason: str):
+        if mask.any():
+            messages.append(reason)
+            codes[mask & (codes == 0)] = len(messages) - 1
+
+    values = {}
+    for column, (dtype, minimum, maximum) in SCHEMA.items():
+        raw = chunk[column]
+        if pd.api.types.is_integer_dtype(raw):
+            # The fast parse gave integers, only the range has to be checked
+            numbers = raw.to_numpy()
+        else:
+            if pd.api.types.is_numeric_dtype(raw):
+                numbers = raw.to_numpy(dtype=np.float64)
+                reject(np.isnan(numbers), '{}: missing value'.format(column))
+            else:
+                # Text in a number column, every value that is not a number becomes NaN
+                numbers = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=np.float64)
+                reject(raw.isna().to_numpy(), '{}: missing value'.format(column))
+                reject(np.isnan(numbers), '{}: not a number'.format(column))
+            reject(np.isinf(numbers), '{}: not a number'.format(column))
+            if np.issubdtype(dtype, np.integer):
+                with np.errstate(invalid='ignore'):
+                    reject(numbers != np.floor(numbers), '{}: not an integer'.format(column))
+        with np.errstate(invalid='ignore'):
+            if minimum is not None:
+                reject(numbers < minimum, '{}: out of range [{}, {}]'.format(column, minimum, maximum))
+            if maximum is not None:
+                reject(numbers > maximum, '{}: out of range [{}, {}]'.format(column, minimum, maximum))
+        values[column] = numbers
+    valid = codes == 0
+    if valid.all():
+        typed = pd.DataFrame(values).astype(DTYPES)
+    else:
+        typed = pd.DataFrame({column: numbers[valid] for column, numbers in values.items()}).astype(DTYPES)
+    with np.errstate(invalid='ignore'):
+        resets = values['sample-id'] == 0
+    return typed, np.array(messages, dtype=object)[codes], resets
+
+
+def _parse(data: bytes, names: list) -> pd.DataFrame:
+    # The C parser with the wide types is the fast path, a file with bad values falls back to letting
+    # pandas guess the types so they can be checked column by column
+    try:
+        return pd.read_csv(io.BytesIO(data), header=None, names=names, usecols=COLUMNS, dtype=PARSE_DTYPES)
+    except (ValueError, OverflowError, TypeError):
+        return pd.read_csv(io.BytesIO(data), header=None, names=names, usecols=COLUMNS)
+
+
+def _split_lines(block: np.ndarray) -> tuple:
+    # Start, end of the text and position of the newline of every line of a block that ends with a newline
+    newlines = np.flatnonzero(block == ord('\n'))
+    if len(newlines) == 0:
+        return newlines, newlines, newlines
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+    # Windows line endings
+    carriage = newlines > starts
+    carriage[carriage] = block[newlines[carriage] - 1] == ord('\r')
+    return starts, newlines - carriage, newlines
+
+
+def read_valid_chunks(path: str = CSV_PATH, chunksize: int = CHUNK_SIZE, quarantine: Quarantine = None):
+    # Yield the valid rows of the CSV in chunks of chunksize lines, typed with the schema, with an array that says
+    # which rows start a new interval (a sample-id of 0 in the row or in a bad row just before it).
+    # The lines with a different number of fields are found counting the commas of every line with NumPy,
+    # the values are checked by validate(), and the bad rows go to the quarantine
+    if quarantine is None:
+        quarantine = Quarantine()
+    with open(path, 'rb') as file:
+        header = file.readline().decode('utf-8-sig').strip().split(',')
+        missing = [column for column in COLUMNS if column not in header]
+        if missing:
+            raise ValueError('{} has no column {}'.format(path, ', '.join(missing)))
+        first_line = 2
+        rows = 0
+        # A reset of a bad row that still has to be given to the next valid row
+        pending = False
+        rest = b''
+        # True while the rest of a line that was too long is skipped
+        long_line = False
+        while True:
+            data = file.read(BLOCK_SIZE)
+            block = rest + data
+            rest = b''
+            if not data:
+                if not block:
+                    break
+                # The last line doesn't always end with a newline
+                block += b'\n'
+            if long_line:
+                end = block.find(b'\n')
+                if end < 0:
+                    continue
+                block = block[end + 1:]
+                long_line = False
+                first_line += 1
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                if len(block) > BLOCK_SIZE:
+                    # A line longer than a whole block (a serial dump without newlines) is left out as one row,
+                    # with only its beginning in the quarantine
+                    quarantine.add(np.array([first_line]), np.array(['line too long'], dtype=object),
+                                   [block[:200].decode('utf-8', 'replace') + '...'])
+                    long_line = True
+                else:
+                    rest = block
+                if not data:
+                    break
+                continue
+            block, rest = block[:cut], block[cut:]
+            array = np.frombuffer(block, dtype=np.uint8)
+            starts, ends, newlines = _split_lines(array)
+            # Commas of every line + 1 (the block ends with a newline, so the last line doesn't take anything else)
+            fields = np.add.reduceat(array == ord(','), starts, dtype=np.int64) + 1 if len(starts) else starts
+            for first in range(0, len(starts), chunksize):
+                part = slice(first, first + chunksize)
+                chunk, resets, pending = _chunk_rows(block, array, starts[part], ends[part], newlines[part], fields[part],
+                                                     first_line + first, header, quarantine, pending)
+                if chunk is not None:
+                    # The index goes on from the last chunk, like the chunks of read_csv
+                    chunk.index = pd.RangeIndex(rows, rows + len(chunk))
+                    rows += len(chunk)
+                    yield chunk, resets
+            first_line += len(starts)
+            if not data:
+                break
+
+
+def _chunk_rows(block: bytes, array: np.ndarray, starts: np.ndarray, ends: np.ndarray, newlines: np.ndarray,
+                fields: np.ndarray, first_line: int, header: list, quarantine: Quarantine, pending: bool) -> tuple:
+    # Returns the valid rows (or None), which of them start a new interval, and whether a reset is still pending
+    lines = first_line + np.arange(len(starts))
+    # Empty lines are skipped, like read_csv does
+    used = ends > starts
+    wrong = used & (fields != len(header))
+    if wrong.any():
+        quarantine.add(lines[wrong], np.array(['wrong number of fields (expected {}, found {})'.format(len(header), count)
+                                               for count in fields[wrong]], dtype=object),
+                       [block[start:end].decode('utf-8', 'replace') for start, end in zip(starts[wrong], ends[wrong])])
+    good = used & ~wrong
+    if not good.any():
+        return None, None, pending
+    if good.all():
+        data = block[starts[0]:newlines[-1] + 1]
+    else:
+        # Only the good lines are joined (with their newlines) and parsed
+        keep = np.repeat(good, newlines - starts + 1)
+        data = array[starts[0]:newlines[-1] + 1][keep].tobytes()
+    chunk, reasons, resets = validate(_parse(data, header))
+    bad = reasons != ''
+    if not bad.any():
+        resets[0] |= pending
+        return chunk, resets, False
+    rows = np.flatnonzero(good)[bad]
+    quarantine.add(lines[rows], reasons[bad],
+                   [block[starts[row]:ends[row]].decode('utf-8', 'replace') for row in rows])
+    # The reset of a bad row goes to the next valid row, so two recordings are never joined because the
+    # first row of the second one was left out. Every row belongs to the first valid row from it on
+    # (the position len(chunk) is the next chunk)
+    valid = ~bad
+    owners = np.cumsum(valid) - valid
+    valid_resets = np.zeros(len(chunk) + 1, dtype=bool)
+    valid_resets[owners[resets]] = True
+    valid_resets[0] |= pending
+    if len(chunk) == 0:
+        return None, None, bool(valid_resets[0])
+    return chunk, valid_resets[:-1], bool(valid_resets[-1])
+
+
+def interval_dtype(last_interval: int):
+    # The smallest unsigned type for the interval numbers (uint8 for less than 256 intervals)
+    return np.min_scalar_type(max(int(last_interval), 0))
+
+
+def read_interval_chunks(path: str = CSV_PATH, chunksize: int = CHUNK_SIZE, quarantine: Quarantine = None):
+    # Same rule as get_data(): each reset of the sample-id starts a new interval,
+    # but the counter is carried from one chunk to the next so the numbering doesn't restart.
+    # Without a quarantine the bad rows are left out with a warning
+    counter = Quarantine() if quarantine is None else quarantine
+    last_interval = 0
+    for chunk, resets in read_valid_chunks(path, chunksize, counter):
+        chunk['interval'] = (last_interval + np.cumsum(resets)).astype(np.int32)
+        if len(chunk) > 0:
+            last_interval = int(chunk['interval'].iloc[-1])
+        yield chunk
+    if quarantine is None and counter.total:
+        warnings.warn('{} rows of {} were left out: {}'.format(
+            counter.total, path, ', '.join('{} {}'.format(count, kind) for kind, count in counter.counts.items())))
+
+
+def stream_intervals(path: str = CSV_PATH, chunksize: int = CHUNK_SIZE):
+    # Yield every interval as a dataframe as soon as the next reset (or the end of the file) closes it.
+    # Only the chunk being read and the interval that is still open are kept in memory
+    pending = []
+    for chunk in read_interval_chunks(path, chunksize):
+        # Positions of the resets inside this chunk
+        resets = np.flatnonzero(chunk['sample-id'].to_numpy() == 0)
+        start = 0
+        for reset in resets:
+            if reset > start:
+                pending.append(chunk.iloc[start:reset])
+            # The reset closes the interval that was open
+            if pending:
+                yield _join(pending)
+                pending = []
+            start = reset
+        if start < len(chunk):
+            pending.append(chunk.iloc[start:])
+    if pending:
+        yield _join(pending)
+
+
+def _join(pieces: list) -> pd.DataFrame:
+    if len(pieces) == 1:
+        return pieces[0]
+    return pd.concat(pieces, ignore_index=False)
+
+
+def load_cached(path: str = CSV_PATH, cache_dir: str = CACHE_DIR) -> pd.DataFrame:
+    # Load the typed dataframe (with the interval column) from the binary cache,
+    # the CSV is only parsed again when it has changed since the cache was written
+    folder = cache_folder(path, cache_dir)
+    if not _cache_is_valid(path, folder):
+        _write_cache(path, folder)
+    with open(os.path.join(folder, 'meta.json')) as file:
+        meta = json.load(file)
+    if meta['rows'] == 0:
+        return pd.DataFrame({column['name']: np.empty(0, dtype=column['dtype']) for column in meta['columns']})
+    # The whole cache is one read-only memory map and every column is a contiguous piece of it,
+    # so nothing is copied and the data is only read from disk when it is used
+    buffer = np.memmap(os.path.join(folder, 'data.bin'), dtype=np.uint8, mode='r')
+    columns = {}
+    for column in meta['columns']:
+        dtype = np.dtype(column['dtype'])
+        columns[column['name']] = buffer[column['offset']:column['offset'] + meta['rows'] * dtype.itemsize].view(dtype)
+    return pd.DataFrame(columns, copy=False)
+
+
+def quarantine_report(path: str = CSV_PATH, cache_dir: str = CACHE_DIR) -> dict:
+    # Number of rows of every kind of error that were left out when the cache was built
+    with open(os.path.join(cache_folder(path, cache_dir), 'meta.json')) as file:
+        return json.load(file).get('quarantined', {})
+
+
+def cache_folder(path: str, cache_dir: str = CACHE_DIR) -> str:
+    # Files with the same name in different folders (one folder per device) can't share the cache
+    path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, '{}-{}'.format(os.path.splitext(os.path.basename(path))[0], path_hash))
+
+
+def _source_info(path: str) -> dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def _file_hash(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _cache_is_valid(path: str, folder: str) -> bool:
+    meta_path = os.path.join(folder, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as file:
+        meta = json.load(file)
+    if meta.get('format') != CACHE_FORMAT:
+        return False
+    info = _source_info(path)
+    if meta['source'] == info:
+        return True
+    # If only the mtime changed (the file was copied or touched) the hash tells us if the content is the same
+    if meta['source']['size'] != info['size'] or meta['sha1'] != _file_hash(path):
+        return False
+    meta['source'] = info
+    _write_json(meta_path, meta)
+    return True
+
+
+def _temporary(path: str) -> str:
+    # A temporary name of every process, two processes that build the same cache never write the same file
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+
+def _write_json(path: str, data: dict):
+    # Write to a temporary file first so the meta file is never read half written
+    temporary = _temporary(path)
+    with open(temporary, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def _write_cache(path: str, folder: str):
+    # The chunks are written as they are read, each column to its own temporary file, and the columns are
+    # joined in data.bin at the end. Only one chunk is in memory, so a log larger than the RAM can be cached.
+    # Every file is written with a temporary name and moved to its place with os.replace (meta.json the last one),
+    # so when several processes build the same cache at once none of them reads the half written files of another
+    os.makedirs(folder, exist_ok=True)
+    meta_path = os.path.join(folder, 'meta.json')
+    info = _source_info(path)
+    quarantine_path = os.path.join(folder, QUARANTINE_FILE)
+    quarantine = Quarantine(_temporary(quarantine_path))
+    names = COLUMNS + ['interval']
+    part_paths = [_temporary(os.path.join(folder, 'column{}'.format(i))) for i in range(len(names))]
+    parts = [open(part_path, 'wb') for part_path in part_paths]
+    rows = 0
+    last_interval = 0
+    try:
+        for chunk in read_interval_chunks(path, quarantine=quarantine):
+            for part, name in zip(parts, names):
+                part.write(np.ascontiguousarray(chunk[name].to_numpy()).tobytes())
+            rows += len(chunk)
+            if len(chunk):
+                last_interval = int(chunk['interval'].iloc[-1])
+    finally:
+        for part in parts:
+            part.close()
+        quarantine.close()
+    # All the columns go one after the other in the same file, each one aligned to 8 bytes
+    dtypes = [np.dtype(DTYPES[name]) for name in COLUMNS] + [np.dtype(interval_dtype(last_interval))]
+    columns = []
+    offset = 0
+    data_path = os.path.join(folder, 'data.bin')
+    with open(_temporary(data_path), 'wb') as file:
+        for name, dtype, part_path in zip(names, dtypes, part_paths):
+            columns.append({'name': name, 'dtype': dtype.str, 'offset': offset})
+            with open(part_path, 'rb') as part:
+                if name == 'interval':
+                    # The interval numbers were written as int32, they get the smallest type a block at a time
+                    for block in iter(lambda: part.read(BLOCK_SIZE), b''):
+                        file.write(np.frombuffer(block, dtype=np.int32).astype(dtype).tobytes())
+                else:
+                    shutil.copyfileobj(part, file, BLOCK_SIZE)
+            os.remove(part_path)
+            nbytes = rows * dtype.itemsize
+            padding = -nbytes % 8
+            file.write(bytes(padding))
+            offset += nbytes + padding
+    # The data that is already memory-mapped by other processes stays valid after the replace (it is the old file)
+    os.replace(_temporary(data_path), data_path)
+    if quarantine.total:
+        os.replace(_temporary(quarantine_path), quarantine_path)
+    else:
+        try:
+            os.remove(quarantine_path)
+        except FileNotFoundError:
+            pass
+    meta = {'format': CACHE_FORMAT, 'source': info, 'sha1': _file_hash(path), 'rows': rows,
+            'columns': columns, 'quarantined': quarantine.counts}
+    _write_json(meta_path, meta)
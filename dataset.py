@@ -0,0 +1,136 @@
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bin_index import BinIndex, build_bin_index
+from data_loader import CACHE_DIR, load_cached
+from interval_stats import SUMMARY_COLUMNS, interval_summary
+
+# A dataset of many micro:bit logs, one CSV per device and day. The files can be named
+# <device>_<YYYY-MM-DD>.csv or be saved as <device>/<YYYY-MM-DD>.csv
+# Nothing is read until the data is needed, and selecting devices or dates only reads those files.
+
+FILE_PATTERN = re.compile(r'^(?P<device>.+?)[_-](?P<date>\d{4}-\d{2}-\d{2})$')
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def describe_file(path: str) -> dict:
+    # Device id and date of a file, taken from its name or from its folder
+    stem = os.path.splitext(os.path.basename(path))[0]
+    match = FILE_PATTERN.match(stem)
+    if match:
+        device, date = match.group('device'), match.group('date')
+    elif DATE_PATTERN.match(stem):
+        device, date = os.path.basename(os.path.dirname(os.path.abspath(path))), stem
+    else:
+        device, date = stem, None
+    return {'path': path, 'device': device, 'date': pd.Timestamp(date) if date else pd.NaT}
+
+
+def find_files(source: str) -> list:
+    # source can be a folder (all the CSVs inside, also in subfolders), a glob pattern or a single file
+    if os.path.isdir(source):
+        pattern = os.path.join(source, '**', '*.csv')
+    else:
+        pattern = source
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+def _build_cache(path: str, cache_dir: str) -> str:
+    # Runs in the workers: the CSV is parsed and saved to the cache, only the path goes back
+    # to the main process, which memory-maps the cache instead of receiving the whole dataframe
+    load_cached(path, cache_dir)
+    return path
+
+
+def _summarize(path: str, cache_dir: str) -> pd.DataFrame:
+    # Runs in the workers too: the file is loaded (and parsed if needed) there, and only the summary
+    # of its intervals goes back, a few numbers per interval
+    return interval_summary(load_cached(path, cache_dir))
+
+
+class SensorDataset:
+    def __init__(self, source, cache_dir: str = CACHE_DIR):
+        # source is a folder or glob pattern, or an already built table of files
+        if isinstance(source, pd.DataFrame):
+            self.files = source.reset_index(drop=True)
+        else:
+            self.files = pd.DataFrame([describe_file(path) for path in find_files(source)],
+                                      columns=['path', 'device', 'date'])
+        self.cache_dir = cache_dir
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def devices(self) -> list:
+        return sorted(self.files['device'].unique())
+
+    def select(self, devices: list = None, start=None, end=None) -> 'SensorDataset':
+        # New dataset with only the files of these devices and dates (both ends included), nothing is read
+        mask = np.ones(len(self.files), dtype=bool)
+        if devices is not None:
+            mask &= self.files['device'].isin(devices).to_numpy()
+        if start is not None:
+            mask &= (self.files['date'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (self.files['date'] <= pd.Timestamp(end)).to_numpy()
+        return SensorDataset(self.files[mask], self.cache_dir)
+
+    def prepare(self, workers: int = None):
+        # Parse the files in parallel, after this every file is read from its cache
+        if len(self.files) == 0:
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_build_cache, self.files['path'], [self.cache_dir] * len(self.files)))
+
+    def iter_frames(self):
+        # One dataframe for each file, tagged with the device and the file.
+        # The interval numbers start again in every file, like in get_data()
+        devices = self.devices()
+        paths = list(self.files['path'])
+        for row in self.files.itertuples():
+            frame = load_cached(row.path, self.cache_dir)
+            n = len(frame)
+            frame['device'] = pd.Categorical.from_codes(np.full(n, devices.index(row.device)), categories=devices)
+            frame['file'] = pd.Categorical.from_codes(np.full(n, paths.index(row.path)), categories=paths)
+            yield frame
+
+    def load(self, workers: int = None) -> pd.DataFrame:
+        self.prepare(workers)
+        frames = list(self.iter_frames())
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def bin_index(self, workers: int = None) -> BinIndex:
+        # Counts of the light, sound and compass charts of all the files, the keys are (file, interval)
+        self.prepare(workers)
+        index = None
+        for frame in self.iter_frames():
+            file_index = build_bin_index(frame).with_prefix(frame['file'].iloc[0]) if len(frame) else None
+            if file_index is not None:
+                index = file_index if index is None else index.merge(file_index)
+        return index
+
+    def summaries(self, workers: int = None) -> pd.DataFrame:
+        # Split-apply-combine over the files: each worker loads one file and summarizes its intervals,
+        # then the summaries are joined in one table with the device, the date and the file of every interval.
+        # The rows are sorted by device, date and interval
+        columns = ['device', 'date', 'file', 'interval'] + SUMMARY_COLUMNS
+        if len(self.files) == 0:
+            return pd.DataFrame(columns=columns)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(_summarize, self.files['path'], [self.cache_dir] * len(self.files)))
+        pieces = []
+        for row, table in zip(self.files.itertuples(), tables):
+            table = table.reset_index()
+            table.insert(0, 'device', row.device)
+            table.insert(1, 'date', row.date)
+            table.insert(2, 'file', row.path)
+            pieces.append(table)
+        result = pd.concat(pieces, ignore_index=True)
+        return result.sort_values(['device', 'date', 'interval'], kind='stable', ignore_index=True)[columns]
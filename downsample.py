@@ -0,0 +1,32 @@
+import numpy as np
+
+# Reduce the number of points of a time series before plotting it without losing the peaks.
+# It uses the M4 algorithm: the series is split in buckets and from every bucket only the first,
+# last, minimum and maximum points are kept, so the lines look the same as with all the samples.
+
+
+def m4_indices(values, max_points: int = None):
+    # Return the positions of the points to plot, or slice(None) when the series is already small
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if max_points is None or n <= max_points or max_points < 4:
+        return slice(None)
+    size = -(-n // (max_points // 4))
+    buckets = -(-n // size)
+    starts = np.arange(buckets) * size
+    # The last bucket can be shorter, it is filled with values that are never the minimum or maximum
+    padded = np.full(buckets * size, np.inf)
+    padded[:n] = values
+    mins = starts + np.argmin(padded.reshape(buckets, size), axis=1)
+    padded[n:] = -np.inf
+    maxs = starts + np.argmax(padded.reshape(buckets, size), axis=1)
+    lasts = np.minimum(starts + size, n) - 1
+    return np.unique(np.concatenate((starts, mins, maxs, lasts)))
+
+
+def decimate(x, y, max_points: int = None) -> tuple:
+    # Same points for x and y
+    x = np.asarray(x)
+    y = np.asarray(y)
+    indices = m4_indices(y, max_points)
+    return x[indices], y[indices]
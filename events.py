@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import CHUNK_SIZE, read_interval_chunks
+
+# Detection of events in whole intervals or in chunks of a stream, with NumPy and no loops over the rows:
+#   sound    the sound level is over SOUND_THRESHOLD (the same 70 dB line of the sound chart)
+#   motion   the magnitude of the acceleration sqrt(x² + y² + z²) is far from the gravity (a movement)
+#   heading  the compass heading changes more than HEADING_THRESHOLD degrees from one sample to the next
+# sound and motion events last while the condition is true, heading events are a single sample.
+# Events never go from one interval to the next one.
+
+SOUND_THRESHOLD = 70
+# The micro:bit measures about 1024 mg when it is not moving
+GRAVITY = 1024
+MOTION_THRESHOLD = 500
+HEADING_THRESHOLD = 90
+
+EVENT_KINDS = ['sound', 'motion', 'heading']
+EVENT_COLUMNS = ['interval', 'event', 'start', 'end', 'start_sample', 'end_sample', 'start_time', 'end_time', 'peak']
+
+
+def acceleration_magnitude(chunk: pd.DataFrame) -> np.ndarray:
+    acc = chunk[['acc-x', 'acc-y', 'acc-z']].to_numpy(dtype=np.float32)
+    return np.sqrt(np.einsum('ij,ij->i', acc, acc))
+
+
+def heading_change(heading: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    # Shortest turn between two headings, from -180 to 180 degrees (350 -> 10 is 20 degrees)
+    return (heading - previous + 180) % 360 - 180
+
+
+def _runs(mask: np.ndarray, breaks: np.ndarray) -> tuple:
+    # Start and end (not included) of every run of True values, a run is cut where an interval starts
+    starts = mask & ~np.concatenate(([False], mask[:-1] & ~breaks[1:]))
+    ends = mask & ~np.concatenate((mask[1:] & ~breaks[1:], [False]))
+    return np.flatnonzero(starts), np.flatnonzero(ends) + 1
+
+
+def _empty_table() -> pd.DataFrame:
+    table = pd.DataFrame({column: pd.Series(dtype=np.float64) for column in EVENT_COLUMNS})
+    return _typed(table)
+
+
+def _typed(table: pd.DataFrame) -> pd.DataFrame:
+    return table.astype({'interval': np.int32, 'event': pd.CategoricalDtype(EVENT_KINDS), 'start': np.int64,
+                         'end': np.int64, 'start_sample': np.int32, 'end_sample': np.int32,
+                         'start_time': np.float32, 'end_time': np.float32, 'peak': np.float32})
+
+
+class EventDetector:
+    # Keeps the state between chunks: the last heading and the events that were still open at the end of a chunk
+    def __init__(self, sound_threshold: float = SOUND_THRESHOLD, motion_threshold: float = MOTION_THRESHOLD,
+                 heading_threshold: float = HEADING_THRESHOLD):
+        self.sound_threshold = sound_threshold
+        self.motion_threshold = motion_threshold
+        self.heading_threshold = heading_threshold
+        self._last_interval = None
+        self._last_heading = None
+        self._open = {}
+
+    def update(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        # Returns the events that ended in this chunk
+        n = len(chunk)
+        if n == 0:
+            return _empty_table()
+        intervals = chunk['interval'].to_numpy()
+        columns = {
+            'interval': intervals,
+            'label': chunk.index.to_numpy(),
+            'sample': chunk['sample-id'].to_numpy(),
+            'time': chunk['Time (seconds)'].to_numpy(),
+        }
+        breaks = np.empty(n, dtype=bool)
+        breaks[0] = self._last_interval is None or intervals[0] != self._last_interval
+        breaks[1:] = intervals[1:] != intervals[:-1]
+
+        tables = []
+        sound = chunk['sound-level'].to_numpy(dtype=np.float32)
+        tables.append(self._run_events('sound', sound > self.sound_threshold, sound, breaks, columns))
+        magnitude = acceleration_magnitude(chunk)
+        deviation = np.abs(magnitude - GRAVITY)
+        tables.append(self._run_events('motion', deviation > self.motion_threshold, magnitude, breaks, columns))
+        tables.append(self._heading_events(chunk['compass-heading'].to_numpy(dtype=np.float32), breaks, columns))
+
+        self._last_interval = intervals[-1]
+        return _concat(tables)
+
+    def finish(self) -> pd.DataFrame:
+        # The events that were still open at the end of the data
+        tables = [self._table(kind, **event) for kind, event in self._open.items()]
+        self._open = {}
+        return _concat(tables)
+
+    def _run_events(self, kind: str, mask: np.ndarray, signal: np.ndarray, breaks: np.ndarray, columns: dict) -> pd.DataFrame:
+        n = len(mask)
+        starts, ends = _runs(mask, breaks)
+        # Highest value of every run with one reduceat (the extra value lets a run end at the last row)
+        bounds = np.column_stack((starts, ends)).ravel()
+        peaks = np.maximum.reduceat(np.append(signal, 0), bounds)[::2] if len(starts) else np.empty(0, dtype=signal.dtype)
+        event = {
+            'interval': columns['interval'][starts], 'start': columns['label'][starts], 'end': columns['label'][ends - 1],
+            'start_sample': columns['sample'][starts], 'end_sample': columns['sample'][ends - 1],
+            'start_time': columns['time'][starts], 'end_time': columns['time'][ends - 1], 'peak': peaks,
+        }
+        closed = []
+        previous = self._open.pop(kind, None)
+        if previous is not None:
+            if len(starts) and starts[0] == 0 and not breaks[0]:
+                # The first run continues the run that was open at the end of the last chunk
+                for key in ['start', 'start_sample', 'start_time', 'interval']:
+                    event[key] = event[key].copy()
+                    event[key][0] = previous[key][0]
+                event['peak'] = event['peak'].copy()
+                event['peak'][0] = max(event['peak'][0], previous['peak'][0])
+            else:
+                closed.append(self._table(kind, **previous))
+        if len(starts) and ends[-1] == n:
+            # The last run may continue in the next chunk
+            self._open[kind] = {key: values[-1:] for key, values in event.items()}
+            event = {key: values[:-1] for key, values in event.items()}
+        closed.append(self._table(kind, **event))
+        return _concat(closed)
+
+    def _heading_events(self, heading: np.ndarray, breaks: np.ndarray, columns: dict) -> pd.DataFrame:
+        previous = np.empty_like(heading)
+        previous[0] = heading[0] if self._last_heading is None else self._last_heading
+        previous[1:] = heading[:-1]
+        change = heading_change(heading, previous)
+        self._last_heading = heading[-1]
+        # The first sample of an interval has no previous heading
+        rows = np.flatnonzero((np.abs(change) > self.heading_threshold) & ~breaks)
+        return self._table('heading', interval=columns['interval'][rows], start=columns['label'][rows],
+                           end=columns['label'][rows], start_sample=columns['sample'][rows],
+                           end_sample=columns['sample'][rows], start_time=columns['time'][rows],
+                           end_time=columns['time'][rows], peak=change[rows])
+
+    @staticmethod
+    def _table(kind: str, **event) -> pd.DataFrame:
+        table = pd.DataFrame(event, columns=[column for column in EVENT_COLUMNS if column != 'event'])
+        table.insert(1, 'event', kind)
+        return _typed(table[EVENT_COLUMNS])
+
+
+def _concat(tables: list) -> pd.DataFrame:
+    tables = [table for table in tables if len(table)]
+    if not tables:
+        return _empty_table()
+    return _typed(pd.concat(tables, ignore_index=True))
+
+
+def detect_events(dataframe: pd.DataFrame, chunksize: int = CHUNK_SIZE, **thresholds) -> pd.DataFrame:
+    # Events of a dataframe that is in memory, sorted by where they start. The detector gets slices
+    # of chunksize rows like in stream_events, so its temporary arrays don't grow with the dataframe
+    detector = EventDetector(**thresholds)
+    tables = [detector.update(dataframe.iloc[i:i + chunksize]) for i in range(0, len(dataframe), chunksize)]
+    tables.append(detector.finish())
+    return _concat(tables).sort_values(['start', 'event'], kind='stable', ignore_index=True)
+
+
+def stream_events(path: str, chunksize: int = CHUNK_SIZE, **thresholds) -> pd.DataFrame:
+    # Events of a CSV read in chunks, only the events are kept in memory
+    detector = EventDetector(**thresholds)
+    tables = [detector.update(chunk) for chunk in read_interval_chunks(path, chunksize)]
+    tables.append(detector.finish())
+    return _concat(tables).sort_values(['start', 'event'], kind='stable', ignore_index=True)
+
+
+def export_events(events: pd.DataFrame, path: str):
+    events.to_csv(path, index=False)
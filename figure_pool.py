@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from itertools import cycle
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.container import Container
+
+# Figures kept between renders when many charts are saved in the same process (batch mode, reports).
+# The figure of every chart and layout is made once, with its style, axes and fixed lines, and the next
+# renders only change the data of its artists (set_data, bar widths, wedge angles...).
+# Every artist has a key, the first time it is made and the next times it is updated:
+#   template.artist(key, create, update)   create() makes the artist, update(artist) changes its data,
+#                                          if update returns False the artist is made again and without
+#                                          update the artist is kept as it is (fixed lines)
+#   template.temporary(artist)             an artist that is removed in the next render (events for example)
+# When the pool is off (the menu shows the windows) every chart gets a new figure that is closed after it is shown.
+
+# Figures kept open at the same time, the one that was used the longest time ago is closed first
+MAX_FIGURES = 8
+
+_style = None
+
+
+def use_style(name: str):
+    # plt.style.use only when the style changes, the figures made before keep the style they were made with
+    global _style
+    if name != _style:
+        plt.style.use(name)
+        _style = name
+
+
+def _remove(artist):
+    # An artist can be a list or a tuple of artists (plot, pie and hist return several)
+    if isinstance(artist, Container):
+        # The bars are also removed from the list of containers of the axis
+        artist.remove()
+    elif isinstance(artist, (list, tuple)):
+        for item in artist:
+            _remove(item)
+    elif artist is not None:
+        artist.remove()
+
+
+class ChartTemplate:
+    def __init__(self, fig, axs):
+        self.fig = fig
+        self.axs = axs
+        self.artists = {}
+        self._temporary = []
+        self._used = set()
+
+    def begin(self):
+        # Start of a new render on the same figure
+        for artist in self._temporary:
+            _remove(artist)
+        self._temporary = []
+        self._used = set()
+
+    def artist(self, key, create, update=None, rescale: bool = True):
+        # rescale says if the limits of the axis follow the data, like a new chart would do
+        artist = self.artists.get(key)
+        existed = artist is not None
+        if artist is None or (update is not None and update(artist) is False):
+            _remove(artist)
+            artist = create()
+            self.artists[key] = artist
+        if existed and rescale:
+            # The limits of the old data are forgotten
+            ax = _axes(artist)
+            ax.relim()
+            ax.autoscale()
+        self._used.add(key)
+        return artist
+
+    # The artists used by the charts, key only has to be unique in the same axis
+
+    def line(self, ax, key, x, y, **kwargs):
+        return self.artist((ax, key), lambda: ax.plot(x, y, **kwargs)[0], lambda line: line.set_data(x, y))
+
+    def vline(self, ax, key, x, **kwargs):
+        return self.artist((ax, key), lambda: ax.axvline(x=x, **kwargs), lambda line: line.set_xdata([x, x]))
+
+    def scatter(self, ax, key, x, y, color, **kwargs):
+        def update(points):
+            points.set_offsets(np.column_stack((x, y)))
+            points.set_facecolor(color)
+        return self.artist((ax, key), lambda: ax.scatter(x, y, color=color, **kwargs), update)
+
+    def fill_between(self, ax, key, x, low, high, **kwargs):
+        def update(band):
+            if not hasattr(band, 'set_data'):
+                return False
+            band.set_data(x, low, high)
+        return self.artist((ax, key), lambda: ax.fill_between(x, low, high, **kwargs), update)
+
+    def text(self, ax, key, x, y, text, **kwargs):
+        def update(label):
+            label.set_position((x, y))
+            label.set_text(text)
+        return self.artist((ax, key), lambda: ax.text(x, y, text, **kwargs), update, rescale=False)
+
+    def annotate(self, ax, key, text, xy, xytext, **kwargs):
+        def update(annotation):
+            annotation.xy = xy
+            annotation.set_position(xytext)
+            annotation.set_text(text)
+        return self.artist((ax, key), lambda: ax.annotate(text, xy=xy, xytext=xytext, **kwargs), update, rescale=False)
+
+    def barh(self, ax, key, positions, widths, color, **kwargs):
+        # The bars are only updated if there are as many as before
+        def update(bars):
+            if len(bars) != len(widths):
+                return False
+            for bar, width, bar_color in zip(bars, widths, cycle(color)):
+                bar.set_width(width)
+                bar.set_facecolor(bar_color)
+        return self.artist((ax, key), lambda: ax.barh(positions, widths, color=color, **kwargs), update)
+
+    def hist(self, ax, key, values, bins: int, range: tuple, weights, **kwargs):
+        # The bins move with the range, so every bar gets its new position, width and height
+        def update(bars):
+            heights, edges = np.histogram(values, bins=bins, range=range, weights=weights)
+            if len(bars) != len(heights):
+                return False
+            for bar, left, right, height in zip(bars, edges[:-1], edges[1:], heights):
+                bar.set_x(left)
+                bar.set_width(right - left)
+                bar.set_height(height)
+        return self.artist((ax, key), lambda: ax.hist(values, bins=bins, range=range, weights=weights, **kwargs)[2],
+                           update)
+
+    def pie(self, ax, key, values, labels, autopct: str, pctdistance: float, labeldistance: float = 1.1, hole: float = None):
+        # The wedges only change their angles and the labels their position, if the number of wedges is the same.
+        # hole is the radius of the white circle in the middle (a donut chart)
+        def create():
+            # A new pie takes its colors from the start, like in a new axis
+            ax.set_prop_cycle(None)
+            wedges, texts, autotexts = ax.pie(values, labels=labels, autopct=autopct, pctdistance=pctdistance,
+                                              labeldistance=labeldistance)
+            circle = [ax.add_artist(plt.Circle((0, 0), hole, fc='white'))] if hole is not None else []
+            return wedges, texts, autotexts, circle
+
+        def update(pie):
+            wedges, texts, autotexts, _ = pie
+            if len(wedges) != len(values):
+                return False
+            start = 0.0
+            for wedge, label, percentage, value, name in zip(wedges, texts, autotexts, values, labels):
+                fraction = value / np.sum(values)
+                wedge.set_theta1(360 * start)
+                wedge.set_theta2(360 * (start + fraction))
+                wedge.set_label(name)
+                middle = np.pi * (2 * start + fraction)
+                x, y = np.cos(middle), np.sin(middle)
+                label.set_position((labeldistance * x, labeldistance * y))
+                label.set_horizontalalignment('left' if x > 0 else 'right')
+                label.set_text(name)
+                percentage.set_position((pctdistance * x, pctdistance * y))
+                percentage.set_text(autopct % (100 * fraction))
+                start += fraction
+        # The pie sets its own limits
+        return self.artist((ax, key), create, update, rescale=False)
+
+    def matshow(self, ax, key, matrix, **kwargs):
+        def update(image):
+            values = np.asarray(matrix)
+            if image.get_array().shape != values.shape:
+                return False
+            image.set_data(values)
+            # The colors go from the minimum to the maximum of the new matrix
+            image.autoscale()
+        return self.artist((ax, key), lambda: ax.matshow(matrix, **kwargs), update, rescale=False)
+
+    def colorbar(self, ax, key, image):
+        return self.artist((ax, key), lambda: self.fig.colorbar(image, ax=ax), lambda bar: bar.update_normal(image),
+                           rescale=False)
+
+    def temporary(self, artist):
+        self._temporary.append(artist)
+        return artist
+
+    def finish(self):
+        # The artists of the last render that were not used in this one are removed before saving
+        for key in [key for key in self.artists if key not in self._used]:
+            _remove(self.artists.pop(key))
+
+
+def _axes(artist):
+    while isinstance(artist, (list, tuple)):
+        artist = artist[0]
+    return artist.axes
+
+
+class FigurePool:
+    def __init__(self, max_figures: int = MAX_FIGURES):
+        self.enabled = False
+        self.max_figures = max_figures
+        self._templates = OrderedDict()
+
+    def subplots(self, name: str, nrows: int = 1, ncols: int = 1, variant=None, **kwargs) -> ChartTemplate:
+        # The same figure is used again for the same chart, layout and variant
+        key = (name, nrows, ncols, variant)
+        template = self._templates.pop(key, None) if self.enabled else None
+        if template is not None:
+            self._templates[key] = template
+            # The plt functions of the charts draw on this figure and on its last axes, like after plt.subplots
+            plt.figure(template.fig)
+            plt.sca(template.axs.flat[-1])
+            template.begin()
+            return template
+        fig, axs = plt.subplots(nrows, ncols, squeeze=False, **kwargs)
+        template = ChartTemplate(fig, axs)
+        if self.enabled:
+            self._templates[key] = template
+            while len(self._templates) > self.max_figures:
+                plt.close(self._templates.popitem(last=False)[1].fig)
+        return template
+
+    def release(self, template: ChartTemplate):
+        # After the chart is saved: the figures of the pool stay open, the rest are closed to release the memory
+        if not any(pooled is template for pooled in self._templates.values()):
+            plt.close(template.fig)
+
+    def clear(self):
+        for template in self._templates.values():
+            plt.close(template.fig)
+        self._templates.clear()
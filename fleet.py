@@ -0,0 +1,133 @@
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from bin_index import COMPASS_LABELS
+from events import GRAVITY, SOUND_THRESHOLD
+from figure_pool import use_style
+
+# Charts that compare many micro:bits, drawn from the table of SensorDataset.summaries() (one row per device,
+# file and interval) instead of the rows of the logs. Each chart is a grid with one small chart per device,
+# all with the same axes, and the intervals of every device go from left to right in the order of their dates.
+
+# Devices in each row of the grid
+MAX_COLUMNS = 4
+# One color for every direction of the compass
+COMPASS_COLORS = [plt.cm.tab10(i) for i in range(len(COMPASS_LABELS))]
+
+
+def device_order(devices) -> list:
+    # Sorted by the numbers in the names, so microbit-2 goes before microbit-10
+    return sorted(devices, key=lambda name: [int(part) if part.isdigit() else part
+                                             for part in re.split(r'(\d+)', str(name))])
+
+
+def _day_ticks(ax, rows: pd.DataFrame):
+    # A tick at the first interval of every day, or at every interval when the file has no date
+    dates = rows['date'].to_numpy()
+    if rows['date'].isna().all():
+        ax.set_xticks(np.arange(len(rows)), labels=['#{}'.format(number) for number in rows['interval']])
+        return
+    first = np.flatnonzero(np.concatenate(([True], dates[1:] != dates[:-1])))
+    ax.set_xticks(first, labels=[pd.Timestamp(dates[i]).strftime('%m-%d') if not pd.isna(dates[i]) else '' for i in first])
+
+
+def small_multiples(summary: pd.DataFrame, title: str, draw, ylabel: str = None):
+    # draw(ax, x, rows) draws the intervals of one device, x is the position of each interval
+    use_style('fivethirtyeight')
+    devices = device_order(summary['device'].unique())
+    ncols = max(1, min(MAX_COLUMNS, len(devices)))
+    nrows = max(1, math.ceil(len(devices) / ncols))
+    fig, axs = plt.subplots(nrows, ncols, squeeze=False, sharey=True, figsize=(4 * ncols, 2.8 * nrows + 0.8))
+    for ax, device in zip(axs.flat, devices):
+        rows = summary[summary['device'] == device]
+        draw(ax, np.arange(len(rows)), rows)
+        ax.set_title(device, fontsize=10)
+        ax.tick_params(labelsize=8)
+        _day_ticks(ax, rows)
+    for ax in axs.flat[len(devices):]:
+        ax.set_visible(False)
+    if ylabel is not None:
+        for ax in axs[:, 0]:
+            ax.set_ylabel(ylabel, fontsize=9)
+    handles, labels = axs.flat[0].get_legend_handles_labels()
+    if handles:
+        fig.legend(handles, labels, loc='lower center', ncol=len(labels), fontsize=8, frameon=False)
+    fig.suptitle(title, fontsize=16)
+    fig.tight_layout(rect=(0, 0.04 if handles else 0, 1, 1))
+    return fig
+
+
+def fleet_temperature(summary: pd.DataFrame):
+    def draw(ax, x, rows):
+        ax.fill_between(x, rows['temp_min'], rows['temp_max'], color='orange', alpha=0.3, label='Min - max')
+        ax.plot(x, rows['temp_mean'], color='red', marker='.', linewidth=1, label='Mean')
+    return small_multiples(summary, 'Temperature', draw, 'ºC')
+
+
+def fleet_light(summary: pd.DataFrame):
+    def draw(ax, x, rows):
+        light = rows['light_fraction'].to_numpy()
+        ax.bar(x, light, color='#ffc61a', label='Light')
+        ax.bar(x, 1 - light, bottom=light, color='#6a5acd', label='Dark')
+    return small_multiples(summary, 'Light', draw, 'Part of the time')
+
+
+def fleet_sound(summary: pd.DataFrame):
+    def draw(ax, x, rows):
+        ax.plot(x, rows['sound_max'], color='lightblue', marker='.', linewidth=1, label='Max')
+        ax.plot(x, rows['sound_mean'], color='blue', marker='.', linewidth=1, label='Mean')
+        ax.axhline(y=SOUND_THRESHOLD, color='red', linestyle='--', linewidth=1, label='{} dB'.format(SOUND_THRESHOLD))
+    return small_multiples(summary, 'Sound', draw, 'dB')
+
+
+def fleet_acceleration(summary: pd.DataFrame):
+    def draw(ax, x, rows):
+        ax.plot(x, rows['motion_max'], color='plum', marker='.', linewidth=1, label='Max')
+        ax.plot(x, rows['motion_mean'], color='purple', marker='.', linewidth=1, label='Mean')
+        ax.axhline(y=GRAVITY, color='gray', linestyle='--', linewidth=1, label='Gravity')
+    return small_multiples(summary, 'Acceleration', draw, 'mg')
+
+
+def fleet_compass_heading(summary: pd.DataFrame):
+    def draw(ax, x, rows):
+        bottom = np.zeros(len(rows))
+        for label, color in zip(COMPASS_LABELS, COMPASS_COLORS):
+            values = rows['compass_' + label].fillna(0).to_numpy()
+            ax.bar(x, values, bottom=bottom, color=color, label=label)
+            bottom += values
+    return small_multiples(summary, 'Compass Heading', draw, 'Part of the time')
+
+
+FLEET_CHARTS = {
+    'fleet_temperature': fleet_temperature,
+    'fleet_light': fleet_light,
+    'fleet_sound': fleet_sound,
+    'fleet_acceleration': fleet_acceleration,
+    'fleet_compass_heading': fleet_compass_heading,
+}
+
+
+def render_fleet_chart(name: str, summary: pd.DataFrame, path: str) -> str:
+    # Runs in the workers, without windows
+    plt.switch_backend('Agg')
+    fig = FLEET_CHARTS[name](summary)
+    # The SVGs are saved without the date, so the same chart always gives the same file
+    kwargs = {'metadata': {'Date': None}} if path.endswith('.svg') else {}
+    fig.savefig(path, dpi=200, **kwargs)
+    plt.close(fig)
+    return path
+
+
+def render_fleet(summary: pd.DataFrame, out_dir: str, workers: int = None, chart_format: str = 'png') -> list:
+    # The five charts at the same time, one per process. The summary is a few numbers per interval,
+    # so sending it to every worker costs nothing next to the drawing
+    os.makedirs(out_dir, exist_ok=True)
+    paths = [os.path.join(out_dir, '{}.{}'.format(name, chart_format)) for name in FLEET_CHARTS]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render_fleet_chart, FLEET_CHARTS, [summary] * len(FLEET_CHARTS), paths))
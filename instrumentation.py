@@ -0,0 +1,127 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Timers around the slow parts of every menu action (load, group, compute, draw, savefig).
+# It is off by default and it is switched on with the MICROBIT_PROFILE environment variable or --profile:
+#   MICROBIT_PROFILE=timers             one JSON line per action and per interval in stderr
+#   MICROBIT_PROFILE=timers,cprofile    also saves a cProfile file of every action in PROFILE_DIR
+#   MICROBIT_PROFILE=tracemalloc        the memory is measured with tracemalloc instead of the RSS
+
+ENV_VAR = 'MICROBIT_PROFILE'
+MODES = {'timers', 'cprofile', 'tracemalloc'}
+PROFILE_DIR = 'profiles'
+
+logger = logging.getLogger('microbit.profile')
+_modes = set()
+# Stage totals of the action that is running
+_current = None
+
+
+def configure(modes: str = None):
+    # modes is a comma separated list, if it is None it is read from the environment variable
+    global _modes
+    if modes is None:
+        modes = os.environ.get(ENV_VAR, '')
+    names = {name.strip().lower() for name in modes.split(',') if name.strip()}
+    if names & {'1', 'on', 'true'}:
+        names = (names - {'1', 'on', 'true'}) | {'timers'}
+    unknown = names - MODES
+    if unknown:
+        raise ValueError('Unknown profile modes: {}'.format(', '.join(sorted(unknown))))
+    _modes = names | {'timers'} if names else set()
+    # The worker processes of the batch mode read it from the environment
+    os.environ[ENV_VAR] = ','.join(sorted(_modes))
+    if 'tracemalloc' in _modes and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if _modes and not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def enabled() -> bool:
+    return bool(_modes)
+
+
+def _memory_kb() -> float:
+    if 'tracemalloc' in _modes:
+        return tracemalloc.get_traced_memory()[0] / 1024
+    try:
+        # Resident memory of the process (Linux)
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+    except (OSError, ValueError):
+        return 0.0
+
+
+def _emit(record: dict):
+    record['pid'] = os.getpid()
+    logger.info(json.dumps(record))
+
+
+@contextmanager
+def stage(name: str, interval=None):
+    # Time of one stage, it is added to the action that is running.
+    # If interval is given a line is also written for that interval
+    if not _modes:
+        yield
+        return
+    start = time.perf_counter()
+    memory = _memory_kb()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if _current is not None:
+            _current['stages'][name] = _current['stages'].get(name, 0.0) + seconds
+        if interval is not None or _current is None:
+            record = {'event': 'stage', 'stage': name, 'seconds': round(seconds, 6),
+                      'memory_delta_kb': round(_memory_kb() - memory, 1)}
+            if interval is not None:
+                record['interval'] = int(interval)
+            if _current is not None:
+                record['action'] = _current['action']
+            _emit(record)
+
+
+@contextmanager
+def action(name: str):
+    # One menu option (or one chart of the batch mode)
+    global _current
+    if not _modes:
+        yield
+        return
+    _current = {'action': name, 'stages': {}}
+    profiler = cProfile.Profile() if 'cprofile' in _modes else None
+    memory = _memory_kb()
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        record = {'event': 'action', 'action': name, 'seconds': round(seconds, 6),
+                  'memory_delta_kb': round(_memory_kb() - memory, 1),
+                  'stages': {key: round(value, 6) for key, value in _current['stages'].items()}}
+        if profiler is not None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, '{}-{}-{}.prof'.format(name, os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+            pstats.Stats(profiler).dump_stats(path)
+            record['profile'] = path
+        _current = None
+        _emit(record)
+
+
+configure()
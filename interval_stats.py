@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+
+from bin_index import COMPASS_LABELS, LIGHT_LABELS, build_bin_index
+from data_loader import CHUNK_SIZE, COLUMNS, SENSORS, interval_bounds, read_interval_chunks
+from events import SOUND_THRESHOLD, acceleration_magnitude
+
+# Statistics of every sensor for every interval computed at once with NumPy, instead of calling
+# .max(), .min(), .idxmax()... on each column of each interval
+
+QUANTILES = [0.25, 0.5, 0.75]
+STATS = ['count', 'min', 'max', 'argmin', 'argmax', 'mean', 'std'] + ['q{:g}'.format(q * 100) for q in QUANTILES]
+# Columns of interval_summary(): the numbers of each interval that the charts of many devices compare
+SUMMARY_COLUMNS = (['rows', 'start_time', 'end_time', 'temp_mean', 'temp_min', 'temp_max', 'light_fraction',
+                    'sound_mean', 'sound_max', 'sound_loud', 'motion_mean', 'motion_max']
+                   + ['compass_' + label for label in COMPASS_LABELS])
+
+
+def compute_stats(dataframe: pd.DataFrame, columns: list = SENSORS) -> pd.DataFrame:
+    # Returns a dataframe indexed by interval with a (column, stat) pair in each column.
+    # argmin and argmax are index labels of the dataframe, like idxmin() and idxmax()
+    # The columns are reduced one at a time, so the temporary arrays are the size of one column and not of the whole frame
+    bounds = interval_bounds(dataframe['interval'].to_numpy())
+    starts, lengths = bounds[:-1], np.diff(bounds)
+    if len(dataframe) == 0:
+        return pd.DataFrame(columns=pd.MultiIndex.from_product([columns, STATS]))
+    # Position of the interval of every row, for the quantiles
+    segment = np.repeat(np.arange(len(starts), dtype=np.int32), lengths)
+    labels = dataframe.index.to_numpy()
+    result = {}
+    for column in columns:
+        values = dataframe[column].to_numpy(dtype=np.float64)
+        mins = np.minimum.reduceat(values, starts)
+        maxs = np.maximum.reduceat(values, starts)
+        means = np.add.reduceat(values, starts) / lengths
+        result[(column, 'count')] = lengths
+        result[(column, 'min')] = mins
+        result[(column, 'max')] = maxs
+        # First row of each interval where the value is the minimum or the maximum
+        result[(column, 'argmin')] = labels[_first_equal(values, mins, starts, lengths)]
+        result[(column, 'argmax')] = labels[_first_equal(values, maxs, starts, lengths)]
+        result[(column, 'mean')] = means
+        # The deviations are taken from the mean of the interval so big values don't lose precision
+        deviations = values - np.repeat(means, lengths)
+        np.square(deviations, out=deviations)
+        squares = np.add.reduceat(deviations, starts)
+        del deviations
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[(column, 'std')] = np.sqrt(squares / (lengths - 1))
+        ordered = values[np.lexsort((values, segment))]
+        del values
+        for q in QUANTILES:
+            result[(column, 'q{:g}'.format(q * 100))] = _segment_quantile(ordered, starts, lengths, q)
+    index = pd.Index(dataframe['interval'].to_numpy()[starts], name='interval')
+    return pd.DataFrame(result, index=index)
+
+
+def _first_equal(values: np.ndarray, targets: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # Position of the first value of every interval that is equal to the target of that interval
+    # (len(values) when there is none). Only the positions that match are kept, not one number per row
+    matches = np.flatnonzero(values == np.repeat(targets, lengths))
+    first = np.searchsorted(matches, starts)
+    found = np.append(matches, len(values))[first]
+    return np.where(found < starts + lengths, found, len(values))
+
+
+def _segment_quantile(ordered: np.ndarray, starts: np.ndarray, lengths: np.ndarray, q: float) -> np.ndarray:
+    # ordered is one column sorted inside every interval (the interval number is the first key).
+    # Interpolate linearly between the two closest ranks, the same as pandas
+    rank = (lengths - 1) * q
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.ceil(rank).astype(np.int64)
+    low, high = ordered[starts + lower], ordered[starts + upper]
+    return low + (high - low) * (rank - lower)
+
+
+def interval_summary(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # A few numbers per interval instead of all the rows, small enough to send from a worker process:
+    # the temperature, the part of the time with light, the sound (and the part over SOUND_THRESHOLD),
+    # the magnitude of the acceleration and the part of the time the compass points to every direction
+    if len(dataframe) == 0:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS, index=pd.Index([], name='interval'))
+    bounds = interval_bounds(dataframe['interval'].to_numpy())
+    starts, lengths = bounds[:-1], np.diff(bounds)
+    time = dataframe['Time (seconds)'].to_numpy(dtype=np.float64)
+    temp = dataframe['temp'].to_numpy(dtype=np.float64)
+    sound = dataframe['sound-level'].to_numpy(dtype=np.float64)
+    magnitude = acceleration_magnitude(dataframe).astype(np.float64)
+    bins = build_bin_index(dataframe)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        light = bins.light[:, LIGHT_LABELS.index('Light')] / bins.light.sum(axis=1)
+        compass = bins.compass / bins.compass.sum(axis=1, keepdims=True)
+    result = {
+        'rows': lengths,
+        'start_time': time[starts],
+        'end_time': time[starts + lengths - 1],
+        'temp_mean': np.add.reduceat(temp, starts) / lengths,
+        'temp_min': np.minimum.reduceat(temp, starts),
+        'temp_max': np.maximum.reduceat(temp, starts),
+        'light_fraction': light,
+        'sound_mean': np.add.reduceat(sound, starts) / lengths,
+        'sound_max': np.maximum.reduceat(sound, starts),
+        'sound_loud': np.add.reduceat(sound > SOUND_THRESHOLD, starts) / lengths,
+        'motion_mean': np.add.reduceat(magnitude, starts) / lengths,
+        'motion_max': np.maximum.reduceat(magnitude, starts),
+    }
+    for j, label in enumerate(COMPASS_LABELS):
+        result['compass_' + label] = compass[:, j]
+    return pd.DataFrame(result, index=pd.Index(dataframe['interval'].to_numpy()[starts], name='interval'))
+
+
+def summary_table(stats: pd.DataFrame) -> pd.DataFrame:
+    # One row for each interval and sensor, easier to read and to save as CSV
+    table = stats.stack(level=0, future_stack=True)
+    table.index.names = ['interval', 'sensor']
+    return table[STATS]
+
+
+def export_stats(stats: pd.DataFrame, path: str):
+    summary_table(stats).to_csv(path)
+
+
+class CorrelationAccumulator:
+    # Correlation matrix updated chunk by chunk, so the data doesn't need to be in memory at once.
+    # It keeps the count, the means and the co-moments (sums of products of the deviations from the mean)
+    # and merges every chunk with the formula of Chan et al., the version of Welford's method for blocks
+    def __init__(self, columns: list):
+        self.columns = list(columns)
+        self.count = 0
+        self.mean = np.zeros(len(self.columns))
+        self.comoment = np.zeros((len(self.columns), len(self.columns)))
+
+    def update(self, values: np.ndarray):
+        # values has one row per sample and one column per element of self.columns
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = values.mean(axis=0)
+        centered = values - mean
+        self._merge(len(values), mean, centered.T @ centered)
+
+    def merge(self, other: 'CorrelationAccumulator'):
+        if other.count:
+            self._merge(other.count, other.mean, other.comoment)
+
+    def _merge(self, count: int, mean: np.ndarray, comoment: np.ndarray):
+        total = self.count + count
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.count * count / total)
+        self.mean += delta * (count / total)
+        self.count = total
+
+    def correlation(self) -> pd.DataFrame:
+        # Columns that never change have no correlation (NaN), the same as DataFrame.corr()
+        deviations = np.sqrt(np.diag(self.comoment))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            matrix = self.comoment / np.outer(deviations, deviations)
+        return pd.DataFrame(np.clip(matrix, -1, 1), index=self.columns, columns=self.columns)
+
+
+class IntervalCorrelations:
+    # One accumulator for each interval and one for all the data
+    def __init__(self, columns: list):
+        self.columns = list(columns)
+        self.intervals = {}
+        self.total = CorrelationAccumulator(self.columns)
+
+    def update(self, chunk: pd.DataFrame):
+        values = chunk[self.columns].to_numpy(dtype=np.float64)
+        interval_numbers = chunk['interval'].to_numpy()
+        bounds = interval_bounds(interval_numbers)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop > start:
+                number = int(interval_numbers[start])
+                self.intervals.setdefault(number, CorrelationAccumulator(self.columns)).update(values[start:stop])
+        self.total.update(values)
+
+    def interval_correlations(self) -> dict:
+        return {number: accumulator.correlation() for number, accumulator in sorted(self.intervals.items())}
+
+    def correlation(self) -> pd.DataFrame:
+        return self.total.correlation()
+
+
+def correlation_columns(columns, exclude=('interval',)) -> list:
+    # Columns used in the correlation matrix, index-like columns can be excluded by name
+    return [column for column in columns if column not in exclude]
+
+
+def interval_correlation(interval: pd.DataFrame, exclude=('interval',)) -> pd.DataFrame:
+    accumulator = CorrelationAccumulator(correlation_columns(interval.columns, exclude))
+    accumulator.update(interval[accumulator.columns].to_numpy(dtype=np.float64))
+    return accumulator.correlation()
+
+
+def stream_correlations(path: str, exclude=('interval',), chunksize: int = CHUNK_SIZE) -> IntervalCorrelations:
+    # Correlations of a CSV that doesn't fit in memory, reading it in chunks.
+    # The columns come from the schema, so a file without valid rows gives empty results
+    result = IntervalCorrelations(correlation_columns(COLUMNS + ['interval'], exclude))
+    for chunk in read_interval_chunks(path, chunksize):
+        result.update(chunk)
+    return result
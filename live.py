@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import sys
+import threading
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.animation import FuncAnimation
+
+from data_loader import COLUMNS
+
+# Watch a micro:bit while it is recording. The rows arrive with the same columns as data/microbit_sensor.csv
+# from a serial port, a pipe (or file) or a TCP socket:
+#   python live.py watch serial:/dev/ttyACM0@115200
+#   python live.py watch tcp://localhost:5000
+#   python live.py fake | python live.py watch -
+
+# Number of samples kept for each sensor
+WINDOW = 600
+FPS = 10
+BAUDRATE = 115200
+
+
+class RingBuffer:
+    # Fixed size buffer, when it is full the oldest value is overwritten
+    def __init__(self, capacity: int):
+        self.data = np.zeros(capacity)
+        self.capacity = capacity
+        self.size = 0
+        self.head = 0
+
+    def append(self, value: float):
+        self.data[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+
+    def values(self) -> np.ndarray:
+        # Values from the oldest to the newest
+        if self.size < self.capacity:
+            return self.data[:self.size].copy()
+        return np.concatenate((self.data[self.head:], self.data[:self.head]))
+
+
+class LiveState:
+    # Buffers of the interval that is being recorded, shared between the reader thread and the plot
+    def __init__(self, window: int = WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.buffers = {column: RingBuffer(window) for column in COLUMNS}
+        self.interval = 0
+        self.samples = 0
+
+    def add(self, row: list):
+        with self.lock:
+            # Same rule as get_data(): a reset of the sample-id starts a new interval
+            if row[COLUMNS.index('sample-id')] == 0:
+                self.interval += 1
+                for buffer in self.buffers.values():
+                    buffer.clear()
+            for column, value in zip(COLUMNS, row):
+                self.buffers[column].append(value)
+            self.samples += 1
+
+    def snapshot(self, columns: list) -> tuple:
+        with self.lock:
+            return self.interval, {column: self.buffers[column].values() for column in columns}
+
+
+def parse_line(line: str):
+    # Return the values of the row, or None for the header and for broken lines
+    fields = line.strip().split(',')
+    if len(fields) != len(COLUMNS):
+        return None
+    try:
+        return [float(field) for field in fields]
+    except ValueError:
+        return None
+
+
+async def read_lines(source: str):
+    if source.startswith('tcp://'):
+        host, port = source[len('tcp://'):].rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            while line := await reader.readline():
+                yield line.decode(errors='replace')
+        finally:
+            writer.close()
+    elif source.startswith('serial:'):
+        # pyserial is only needed for this mode
+        import serial
+        port, _, baudrate = source[len('serial:'):].partition('@')
+        with serial.Serial(port, int(baudrate or BAUDRATE), timeout=1) as device:
+            while True:
+                line = await asyncio.to_thread(device.readline)
+                if line:
+                    yield line.decode(errors='replace')
+    else:
+        # A pipe, a fifo or a file, '-' is the standard input
+        file = sys.stdin.buffer if source == '-' else open(source, 'rb')
+        try:
+            while line := await asyncio.to_thread(file.readline):
+                yield line.decode(errors='replace')
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+
+
+async def ingest(source: str, state: LiveState):
+    async for line in read_lines(source):
+        row = parse_line(line)
+        if row is not None:
+            state.add(row)
+
+
+def start_ingest_thread(source: str, state: LiveState) -> threading.Thread:
+    # The reader has its own event loop in a thread because matplotlib needs the main thread
+    thread = threading.Thread(target=asyncio.run, args=(ingest(source, state),), daemon=True)
+    thread.start()
+    return thread
+
+
+def live_plot(state: LiveState, fps: int = FPS) -> FuncAnimation:
+    plt.style.use('fivethirtyeight')
+    fig, (acc_ax, temp_ax) = plt.subplots(2, 1, sharex=True)
+    # The limits are fixed so only the lines have to be redrawn on every frame (blitting)
+    acc_ax.set_xlim(0, state.window)
+    acc_ax.set_ylim(-2050, 2050)
+    acc_ax.set_ylabel('Acceleration (mg)')
+    temp_ax.set_ylim(24, 35)
+    temp_ax.set_ylabel('Temperature (ºC)')
+    temp_ax.set_xlabel('Nº of measurements')
+    colors = {'acc-x': '#ff3333', 'acc-y': '#a64dff', 'acc-z': '#33cccc', 'temp': 'orange'}
+    lines = {column: acc_ax.plot([], [], color=colors[column], label=column[-1].upper(), animated=True)[0]
+             for column in ['acc-x', 'acc-y', 'acc-z']}
+    lines['temp'] = temp_ax.plot([], [], color=colors['temp'], animated=True)[0]
+    acc_ax.legend(loc='upper right')
+    title = acc_ax.text(0.01, 0.95, '', transform=acc_ax.transAxes, va='top', animated=True)
+    fig.suptitle('Live micro:bit', fontsize=16)
+
+    def update(frame):
+        interval, values = state.snapshot(list(lines))
+        for column, line in lines.items():
+            line.set_data(np.arange(len(values[column])), values[column])
+        title.set_text('Interval {}'.format(interval))
+        return [*lines.values(), title]
+
+    animation = FuncAnimation(fig, update, interval=1000 / fps, blit=True, cache_frame_data=False)
+    plt.show()
+    return animation
+
+
+def fake_rows(rate: float, interval_length: int, seed: int = 0):
+    # Fake micro:bit: random walks with the same ranges as the real sensors and a reset of
+    # the sample-id every interval_length samples
+    rng = np.random.default_rng(seed)
+    time_seconds = 0.0
+    temp = 28.0
+    heading = 180.0
+    sample_id = 0
+    while True:
+        temp = np.clip(temp + rng.normal(0, 0.05), 24, 34)
+        heading = (heading + rng.normal(0, 5)) % 360
+        acc = np.clip(rng.normal([-250, -550, -400], 300), -2048, 2047)
+        yield '{:.2f},{},{},{},{},{},{},{},{}\n'.format(
+            time_seconds, sample_id, round(temp), rng.integers(0, 256), rng.integers(0, 200),
+            int(acc[0]), int(acc[1]), int(acc[2]), int(heading))
+        time_seconds += 1 / rate
+        sample_id = (sample_id + 1) % interval_length
+
+
+async def write_fake_rows(write, rate: float, interval_length: int):
+    write(','.join(COLUMNS) + '\n')
+    for row in fake_rows(rate, interval_length):
+        write(row)
+        await asyncio.sleep(1 / rate)
+
+
+async def fake_device(port: int = None, rate: float = 20, interval_length: int = 500):
+    if port is None:
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        await write_fake_rows(write, rate, interval_length)
+        return
+
+    async def handle(reader, writer):
+        try:
+            await write_fake_rows(lambda text: writer.write(text.encode()), rate, interval_length)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, 'localhost', port)
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Live data of a Micro:bit')
+    commands = parser.add_subparsers(dest='command', required=True)
+    watch = commands.add_parser('watch', help='plot the data of a device while it is recording')
+    watch.add_argument('source', help="serial:PORT[@BAUD], tcp://HOST:PORT, a file or '-' for the standard input")
+    watch.add_argument('--window', type=int, default=WINDOW, help='number of samples shown')
+    watch.add_argument('--fps', type=int, default=FPS, help='frames per second of the plot')
+    fake = commands.add_parser('fake', help='fake device that writes rows to the standard output or a TCP port')
+    fake.add_argument('--port', type=int, default=None)
+    fake.add_argument('--rate', type=float, default=20, help='samples per second')
+    fake.add_argument('--interval-length', type=int, default=500, help='samples before the sample-id is reset')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'watch':
+        state = LiveState(args.window)
+        start_ingest_thread(args.source, state)
+        live_plot(state, args.fps)
+    else:
+        try:
+            asyncio.run(fake_device(args.port, args.rate, args.interval_length))
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
@@ -1,201 +1,359 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from data_loader import interval_bounds
+from downsample import decimate
+from events import export_events
+from figure_pool import FigurePool, use_style
+from instrumentation import action, configure, stage
+from interval_stats import export_stats, interval_correlation, stream_correlations
+from render_queue import RenderQueue
+from query import SensorLog
+from render_manifest import interval_hash, is_up_to_date, load_manifest, output_key, save_manifest
+from rollups import choose_level
+
 # Student: Ivan Martinez
 
+# Log that is analysed, the reports of other devices change it with the MICROBIT_DATA environment variable
+DATA_PATH = os.environ.get('MICROBIT_DATA', 'data/microbit_sensor.csv')
+# Nothing is read until a chart (or the export) needs the data, so the menu opens at once.
+# The intervals, statistics, counts, events and rollups are computed the first time they are used
+DATA = SensorLog(DATA_PATH)
+
 def get_data() -> pd.DataFrame:
-    # Read data from CSV file and make a dataframe using pandas
-    dataframe = pd.read_csv('data/microbit_sensor.csv')
+    # Read data from the binary cache, the CSV is only parsed again when it has changed
     # Each reset of the sample-id means a new measurements so I will treat as a new interval
-    # I will use the cumsum function to count the number of measurements
-    dataframe['interval'] = (dataframe['sample-id'] == 0).cumsum()
-    # Now I can group the data by measurement and return the grouped object to make the plots
-    data_by_interval = dataframe.groupby('interval')
-    # Get the number of intervals by counting the number of groups
-    return data_by_interval
-
-data_by_interval = get_data()
-# Get the intervals as dataframes
-first_interval = data_by_interval.get_group(1)
-second_interval = data_by_interval.get_group(2)
-third_interval = data_by_interval.get_group(3)
-# Make a list of intervals
-list_of_intervals = [first_interval, second_interval, third_interval]
+    # The loader uses the cumsum of the resets to count the number of measurements
+    # The cache is written chunk by chunk by the streaming reader and the columns are memory-mapped,
+    # so the whole log is never in memory at once, only the pages the charts use are read.
+    # The statistics, events and rollups still grow with the log (one column at a time, one row per event and per bucket)
+    # To go through the intervals one by one without the cache there is stream_intervals() in data_loader
+    return DATA.frame
+
+def split_intervals(dataframe: pd.DataFrame) -> list:
+    # Instead of copying every group I slice the dataframe where the interval number changes
+    bounds = interval_bounds(dataframe['interval'].to_numpy())
+    return [dataframe.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+# Folder where the charts are saved, it can be changed with --out
+CHARTS_DIR = 'charts'
+# png or svg, the format of the saved charts
+CHART_FORMAT = 'png'
+# In the batch mode the charts are only saved, plt.show() would block the workers
+SHOW_CHARTS = True
+# Pages that have to be drawn, None means all of them (the batch mode skips the pages that didn't change)
+PAGES_TO_RENDER = None
+# Columns left out of the correlation heatmaps, like the old chart it only excludes the interval number
+CORRELATION_EXCLUDE = ['interval']
+# Maximum number of points of each line in the time series charts, None draws all the samples
+MAX_POINTS = None
+# Draw the motion and heading events on the acceleration chart
+SHOW_EVENTS = False
+
+# Figures used again from one chart to the next one, it is only on when the charts are not shown
+FIGURES = FigurePool()
+
+# Maximum number of intervals drawn in the same figure, the rest go to the next pages
+INTERVALS_PER_PAGE = 3
+# The first colors are the ones of the original charts, after that it uses the tab20 colormap
+INTERVAL_COLORS = ['pink', 'orange', 'green'] + [plt.cm.tab20(i) for i in range(20)]
+
+def paginate(list_of_intervals: list):
+    # Yield the page number and the intervals of that page
+    for page, start in enumerate(range(0, len(list_of_intervals), INTERVALS_PER_PAGE), start=1):
+        if PAGES_TO_RENDER is not None and page not in PAGES_TO_RENDER:
+            continue
+        yield page, list_of_intervals[start:start + INTERVALS_PER_PAGE]
+
+def chart_file(name: str, page: int) -> str:
+    # The first page keeps the original name of the chart
+    if page == 1:
+        return '{}.{}'.format(name, CHART_FORMAT)
+    return '{}_p{}.{}'.format(name, page, CHART_FORMAT)
+
+def chart_path(name: str, page: int) -> str:
+    return os.path.join(CHARTS_DIR, chart_file(name, page))
+
+def save_chart(path: str, template, **kwargs):
+    # The SVGs are saved without the date, so the same chart always gives the same file
+    if CHART_FORMAT == 'svg':
+        kwargs['metadata'] = {'Date': None}
+    template.finish()
+    template.fig.savefig(path, dpi=200, **kwargs)
+
+def show_chart(template):
+    if SHOW_CHARTS:
+        plt.show()
+    else:
+        # The figure stays in the pool for the next chart, or it is closed so the memory is released
+        FIGURES.release(template)
+
+def interval_color(position: int):
+    return INTERVAL_COLORS[position % len(INTERVAL_COLORS)]
+
+# The old names of the loaded data (main.stats, main.list_of_intervals...) still work from other modules
+LAZY_NAMES = {'dataframe': 'frame', 'list_of_intervals': 'intervals', 'stats': 'stats', 'bins': 'bins',
+              'events': 'events', 'rollups': 'rollups'}
+
+def __getattr__(name: str):
+    if name in LAZY_NAMES:
+        return getattr(DATA, LAZY_NAMES[name])
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def all_data(list_of_intervals: list):
-    plt.style.use('fivethirtyeight')
-    for interval in list_of_intervals:
-        plt.title('Interval {}'.format(interval['interval'].iloc[0])) # Automatically gets the interval number
-        # Plot all data except Time and sample-id
-        plt.plot(interval.loc[:, ~interval.columns.isin(['Time (seconds)', 'sample-id'])])
-        plt.xlabel('Sample ID')
-        plt.ylabel('Values')
-        plt.legend(interval.loc[:, ~interval.columns.isin(['Time (seconds)', 'sample-id'])])
+    use_style('fivethirtyeight')
+    # Each interval has its own chart, so here the page is the position of the interval
+    for page, interval in enumerate(list_of_intervals, start=1):
+        if PAGES_TO_RENDER is not None and page not in PAGES_TO_RENDER:
+            continue
+        with stage('draw', interval=interval['interval'].iloc[0]):
+            template = FIGURES.subplots('all_data')
+            plt.title('Interval {}'.format(interval['interval'].iloc[0])) # Automatically gets the interval number
+            # Plot all data except Time and sample-id
+            # Each column is decimated on its own so every line keeps its peaks
+            for column in interval.columns[~interval.columns.isin(['Time (seconds)', 'sample-id'])]:
+                template.line(template.axs[0, 0], column, *decimate(interval.index, interval[column], MAX_POINTS))
+            plt.xlabel('Sample ID')
+            plt.ylabel('Values')
+            plt.legend(interval.loc[:, ~interval.columns.isin(['Time (seconds)', 'sample-id'])])
         # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-        plt.savefig('charts/plot_alldata{}.png'.format(interval['interval'].iloc[0]), dpi=200)
-        plt.show()
+        with stage('savefig'):
+            save_chart(os.path.join(CHARTS_DIR, 'plot_alldata{}.{}'.format(interval['interval'].iloc[0], CHART_FORMAT)), template)
+        show_chart(template)
     
 def historic_temperature(list_of_intervals: list):
     # Convert the seconds to minutes to make the plot more readable
-    plt.style.use('fivethirtyeight')
-    plt.scatter(list_of_intervals[0]['Time (seconds)']/60, list_of_intervals[0]['temp'], color='pink', edgecolor='black')
-    plt.scatter(list_of_intervals[1]['Time (seconds)']/60, list_of_intervals[1]['temp'], color='orange', edgecolor='black')
-    plt.scatter(list_of_intervals[2]['Time (seconds)']/60, list_of_intervals[2]['temp'], color='green', edgecolor='black')
-    # Set the ticks of the y axis to be more readable
-    plt.yticks(np.arange(24, 35, 1))        
-    plt.ylabel('Temperature (ºC)')
-    plt.suptitle('Temperature over time', fontsize=16)
-    plt.xlabel('Time (minutes)')
-    plt.xticks(np.arange(0, 240, 15))
-    plt.legend(['Interval 1', 'Interval 2', 'Interval 3'])
-    plt.grid(True)
-    # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-    plt.savefig('charts/scatter_temperature.png', bbox_inches ="tight", dpi=200)
-    plt.show()
+    use_style('fivethirtyeight')
+    for page, intervals in paginate(list_of_intervals):
+        first = (page - 1) * INTERVALS_PER_PAGE
+        colors = [interval_color(first + position) for position in range(len(intervals))]
+        span = max(interval['Time (seconds)'].max() for interval in intervals)
+        # Long captures have more samples than pixels, then each point is the mean of a bucket of the rollups
+        # and the band goes from the minimum to the maximum of the bucket
+        level = choose_level(span, int(plt.rcParams['figure.figsize'][0] * 200))
+        # The ticks of every 15 minutes only fit the short captures, the long ones use the default ticks
+        short = span <= 240 * 60
+        template = FIGURES.subplots('historic_temperature', variant=(len(intervals), level, short))
+        ax = template.axs[0, 0]
+        with stage('draw'):
+            if level is None:
+                # All the intervals of the page are drawn with one scatter call, the color of each point
+                # is the color of its interval
+                positions = np.repeat(np.arange(len(intervals)), [len(interval) for interval in intervals])
+                template.scatter(ax, 'temperature',
+                                 np.concatenate([interval['Time (seconds)'].to_numpy() for interval in intervals])/60,
+                                 np.concatenate([interval['temp'].to_numpy() for interval in intervals]),
+                                 [colors[position] for position in positions], edgecolor='black')
+            else:
+                for position, (color, interval) in enumerate(zip(colors, intervals)):
+                    table = DATA.rollups.level(level, interval=int(interval['interval'].iloc[0]), column='temp')
+                    minutes = (table['start'] + level / 2) / 60
+                    template.fill_between(ax, ('band', position), minutes, table[('temp', 'min')], table[('temp', 'max')],
+                                          color=color, alpha=0.3)
+                    template.scatter(ax, ('mean', position), minutes, table[('temp', 'mean')], color, edgecolor='black', s=10)
+        # Set the ticks of the y axis to be more readable
+        plt.yticks(np.arange(24, 35, 1))        
+        plt.ylabel('Temperature (ºC)')
+        plt.suptitle('Temperature over time', fontsize=16)
+        plt.xlabel('Time (minutes)')
+        if short:
+            plt.xticks(np.arange(0, 240, 15))
+        # With only one scatter the legend needs a marker for each interval
+        handles = [plt.Line2D([], [], marker='o', linestyle='', color=color, markeredgecolor='black') for color in colors]
+        plt.legend(handles, ['Interval {}'.format(interval['interval'].iloc[0]) for interval in intervals])
+        plt.grid(True)
+        # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
+        with stage('savefig'):
+            save_chart(chart_path('scatter_temperature', page), template, bbox_inches ="tight")
+        show_chart(template)
     
 def historic_light(list_of_intervals: list):
-    plt.style.use('fivethirtyeight')
-    fig, axs = plt.subplots(len(list_of_intervals), 1)
-    bins = np.linspace(0, 300, 3) 
-    labels = ['Dark', 'Light']
+    use_style('fivethirtyeight')
     colors = ['#6a5acd', '#ffc61a']
     
-    for i, interval in enumerate(list_of_intervals):
-        axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
-        binned = pd.cut(interval['light'], bins=bins, labels=labels,  right=False)  # Set right=False to include the rightmost edge
-        # Count the number of values in each bin
-        counts = binned.value_counts()
-        # Remove the labels that are 0%
-        counts = counts[counts != 0]   
-        axs[i].barh(counts.index, counts, color=colors, edgecolor='black') 
-        # Calculate the percentage for each bin
-        percentages = counts / counts.sum() * 100
-        # Add percentage labels to the bars
-        for j, (count, percentage) in enumerate(zip(counts, percentages)):
-            axs[i].text(count, j, f' {percentage:.1f}%', va='center')
-    
-    axs[1].set_ylabel('Light level (lux)')
-    fig.suptitle('Light level', fontsize=16)
-    plt.xlabel('Nº of measurements')
-    plt.subplots_adjust(hspace=0.55)
-    # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-    plt.savefig('charts/barh_light.png', bbox_inches ="tight", dpi=200)
-    plt.show()
+    for page, intervals in paginate(list_of_intervals):
+        template = FIGURES.subplots('historic_light', len(intervals), 1)
+        fig, axs = template.fig, template.axs[:, 0]
+        for i, interval in enumerate(intervals):
+            with stage('draw', interval=interval['interval'].iloc[0]):
+                axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
+                # The number of values in each bin (Dark is [0, 150) and Light [150, 300)) comes from the bin index,
+                # sorted like value_counts() did
+                counts = DATA.bins.light_counts(interval['interval'].iloc[0]).sort_values(ascending=False, kind='stable')
+                # Remove the labels that are 0%
+                counts = counts[counts != 0]   
+                # The bars are at 0, 1... with the names of the bins as labels, so the same axis can show other bins later
+                template.barh(axs[i], 'light', np.arange(len(counts)), counts.to_numpy(), colors, edgecolor='black')
+                axs[i].set_yticks(np.arange(len(counts)), labels=counts.index)
+                # Calculate the percentage for each bin
+                percentages = counts / counts.sum() * 100
+                # Add percentage labels to the bars
+                for j, (count, percentage) in enumerate(zip(counts, percentages)):
+                    template.text(axs[i], ('percentage', j), count, j, f' {percentage:.1f}%', va='center')
+        
+        axs[len(axs) // 2].set_ylabel('Light level (lux)')
+        fig.suptitle('Light level', fontsize=16)
+        plt.xlabel('Nº of measurements')
+        plt.subplots_adjust(hspace=0.55)
+        # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
+        with stage('savefig'):
+            save_chart(chart_path('barh_light', page), template, bbox_inches ="tight")
+        show_chart(template)
      
 def historic_sound(list_of_intervals: list):
-    plt.style.use('fivethirtyeight')
+    use_style('fivethirtyeight')
 
-    fig, axs = plt.subplots(1, len(list_of_intervals), sharex=True)
-    for i, interval in enumerate(list_of_intervals):
-        
-        axs[i].hist(interval['sound-level'], color='gray', edgecolor='black')
-        axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
-        axs[i].set_xticks(np.arange(0, 220, 20))
-        axs[i].axvline(x=70, color='red', label='Threshold')
-        axs[i].axvline(x=interval['sound-level'].mean(), color='orange', label='Mean')
-        
-    plt.legend()
-    axs[1].set_xlabel('Sound level (dB)')
-    axs[0].set_ylabel('Nº of measurements')
-    fig.suptitle('Sound level', fontsize=16)
-    # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-    plt.savefig('charts/hist_sound_level.png', bbox_inches ="tight", dpi=200)
-    plt.show()
+    for page, intervals in paginate(list_of_intervals):
+        template = FIGURES.subplots('historic_sound', 1, len(intervals), sharex=True)
+        fig, axs = template.fig, template.axs[0]
+        for i, interval in enumerate(intervals):
+            
+            with stage('draw', interval=interval['interval'].iloc[0]):
+                # The histogram is made from the counts of every dB value in the bin index,
+                # with the same 10 bins between the minimum and the maximum as before
+                counts = DATA.bins.sound_counts(interval['interval'].iloc[0])
+                levels = np.flatnonzero(counts)
+                template.hist(axs[i], 'sound', levels, bins=10, range=(levels.min(), levels.max()), weights=counts[levels],
+                              color='gray', edgecolor='black')
+                axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
+                axs[i].set_xticks(np.arange(0, 220, 20))
+                template.vline(axs[i], 'threshold', 70, color='red', label='Threshold')
+                template.vline(axs[i], 'mean', DATA.stats.loc[interval['interval'].iloc[0], ('sound-level', 'mean')], color='orange', label='Mean')
+            
+        plt.legend()
+        axs[len(axs) // 2].set_xlabel('Sound level (dB)')
+        axs[0].set_ylabel('Nº of measurements')
+        fig.suptitle('Sound level', fontsize=16)
+        # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
+        with stage('savefig'):
+            save_chart(chart_path('hist_sound_level', page), template, bbox_inches ="tight")
+        show_chart(template)
     
 def historic_acceleration(list_of_intervals: list):
-    plt.style.use('fivethirtyeight')
-    fig, axs = plt.subplots(len(list_of_intervals), 1)
-    for i, interval in enumerate(list_of_intervals):
-        axs[i].plot(interval['sample-id'], interval['acc-x'], color='#ff3333', label='X')  
-        axs[i].plot(interval['sample-id'], interval['acc-y'], color='#a64dff', label='Y')  
-        axs[i].plot(interval['sample-id'], interval['acc-z'], color='#33cccc', label='Z')
-    
-        axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
-        axs[i].set_yticks(np.arange(-2050, 2500, 500))
+    use_style('fivethirtyeight')
+    for page, intervals in paginate(list_of_intervals):
+        template = FIGURES.subplots('historic_acceleration', len(intervals), 1)
+        fig, axs = template.fig, template.axs[:, 0]
+        for i, interval in enumerate(intervals):
+            with stage('draw', interval=interval['interval'].iloc[0]):
+                # The lines can be decimated, but the annotations below use all the samples
+                template.line(axs[i], 'acc-x', *decimate(interval['sample-id'], interval['acc-x'], MAX_POINTS), color='#ff3333', label='X')  
+                template.line(axs[i], 'acc-y', *decimate(interval['sample-id'], interval['acc-y'], MAX_POINTS), color='#a64dff', label='Y')  
+                template.line(axs[i], 'acc-z', *decimate(interval['sample-id'], interval['acc-z'], MAX_POINTS), color='#33cccc', label='Z')
         
-        # Annotate maximum and minimum values
-        # First define the coordinates of the values
-        max_x = interval['sample-id'][interval['acc-x'].idxmax()]
-        max_y = interval['sample-id'][interval['acc-y'].idxmax()]
-        max_z = interval['sample-id'][interval['acc-z'].idxmax()]
-        min_x = interval['sample-id'][interval['acc-x'].idxmin()]
-        min_y = interval['sample-id'][interval['acc-y'].idxmin()]
-        min_z = interval['sample-id'][interval['acc-z'].idxmin()]
-        # Annotate the values
-        axs[i].annotate('Max: {}'.format(interval['acc-x'].max()), xy=(max_x, interval['acc-x'].max()), xytext=(max_x, interval['acc-x'].max() + 750),
-                        arrowprops=dict(facecolor='black', arrowstyle='simple'))
-        axs[i].annotate('Max: {}'.format(interval['acc-y'].max()), xy=(max_y, interval['acc-y'].max()), xytext=(max_y, interval['acc-y'].max() + 750),
-                        arrowprops=dict(facecolor='black', arrowstyle='simple'))
-        axs[i].annotate('Max: {}'.format(interval['acc-z'].max()), xy=(max_z, interval['acc-z'].max()), xytext=(max_z, interval['acc-z'].max() + 750),
-                        arrowprops=dict(facecolor='black', arrowstyle='simple'))
-        axs[i].annotate('Min: {}'.format(interval['acc-x'].min()), xy=(min_x, interval['acc-x'].min()), xytext=(min_x, interval['acc-x'].min() - 750),
-                        arrowprops=dict(facecolor='black', arrowstyle='simple'))
-        axs[i].annotate('Min: {}'.format(interval['acc-y'].min()), xy=(min_y, interval['acc-y'].min()), xytext=(min_y, interval['acc-y'].min() - 750),
-                        arrowprops=dict(facecolor='black', arrowstyle='simple'))
-        axs[i].annotate('Min: {}'.format(interval['acc-z'].min()), xy=(min_z, interval['acc-z'].min()), xytext=(min_z, interval['acc-z'].min() - 750),
-                        arrowprops=dict(facecolor='black', arrowstyle='simple'))
-    
-    plt.legend()
-    axs[1].set_ylabel('Acceleration (mg)')
-    plt.xlabel('Nº of measurements')
-    fig.suptitle('Acceleration or deceleration', fontsize=16)
-    plt.subplots_adjust(hspace=0.55)
-    # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-    plt.savefig('charts/plot_accel.png', bbox_inches ="tight", dpi=200)
-    plt.show()
+                axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
+                axs[i].set_yticks(np.arange(-2050, 2500, 500))
+            
+                # Annotate maximum and minimum values
+                # The values and their positions come from the statistics, the x coordinate is the sample-id of that row
+                interval_stats = DATA.stats.loc[interval['interval'].iloc[0]]
+                for stat, position, label, offset in [('max', 'argmax', 'Max', 750), ('min', 'argmin', 'Min', -750)]:
+                    for axis in ['acc-x', 'acc-y', 'acc-z']:
+                        value = interval_stats[(axis, stat)]
+                        x = interval['sample-id'][int(interval_stats[(axis, position)])]
+                        template.annotate(axs[i], (stat, axis), '{}: {:g}'.format(label, value), (x, value), (x, value + offset),
+                                          arrowprops=dict(facecolor='black', arrowstyle='simple'))
+                if SHOW_EVENTS:
+                    # The motion bursts are shaded and the sudden heading changes are dotted lines,
+                    # there is a different number of them in every interval so they are made again every time
+                    interval_events = DATA.events[DATA.events['interval'] == interval['interval'].iloc[0]]
+                    for event in interval_events[interval_events['event'] == 'motion'].itertuples():
+                        template.temporary(axs[i].axvspan(event.start_sample - 0.5, event.end_sample + 0.5, color='gray', alpha=0.3, lw=0))
+                    for event in interval_events[interval_events['event'] == 'heading'].itertuples():
+                        template.temporary(axs[i].axvline(event.start_sample, color='black', linestyle=':', linewidth=1, alpha=0.4))
+        
+        plt.legend()
+        axs[len(axs) // 2].set_ylabel('Acceleration (mg)')
+        plt.xlabel('Nº of measurements')
+        fig.suptitle('Acceleration or deceleration', fontsize=16)
+        plt.subplots_adjust(hspace=0.55)
+        # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
+        with stage('savefig'):
+            save_chart(chart_path('plot_accel', page), template, bbox_inches ="tight")
+        show_chart(template)
         
 
 def historic_compass_heading(list_of_intervals: list):
-    fig, axs = plt.subplots(1, len(list_of_intervals))
-    labels = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
-    # We need to divide the compass heading values into 8 bins
+    # The compass heading values are divided into 8 bins in the bin index
     # The first bin is from -22.5 to 22.5 degrees so it will be labeled as N and we will start from there
-    bins = np.linspace(-22.5, 360-22.5, 9)
-    for i, interval in enumerate(list_of_intervals):
-        # Use pandas.cut to bin the compass heading values
-        binned = pd.cut(interval['compass-heading'], bins=bins, labels=labels)
-        # Count the number of values in each bin
-        counts = binned.value_counts()
-        # Remove the labels that are 0%
-        counts = counts[counts != 0]
-        # Plot the pie chart
-        axs[i].pie(counts, labels=counts.index, autopct='%1.1f%%', pctdistance=0.8)
-        axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
-        centre_circle = plt.Circle((0, 0), 0.65, fc='white')
-        axs[i].add_artist(centre_circle)
-    
-    fig.suptitle('Compass heading')
-    # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-    plt.savefig('charts/pie_compass_heading.png', dpi=200)
-    plt.show()
-    
-def correlations(list_of_intervals: list):
-    fig, axs = plt.subplots(1, len(list_of_intervals), figsize=(8, 5))
+    for page, intervals in paginate(list_of_intervals):
+        template = FIGURES.subplots('historic_compass_heading', 1, len(intervals))
+        fig, axs = template.fig, template.axs[0]
+        for i, interval in enumerate(intervals):
+            with stage('draw', interval=interval['interval'].iloc[0]):
+                # Count the number of values in each bin, sorted like value_counts() did
+                counts = DATA.bins.compass_counts(interval['interval'].iloc[0]).sort_values(ascending=False, kind='stable')
+                # Remove the labels that are 0%
+                counts = counts[counts != 0]
+                # Plot the pie chart with a white circle in the centre
+                template.pie(axs[i], 'compass', counts.to_numpy(), list(counts.index), autopct='%1.1f%%', pctdistance=0.8, hole=0.65)
+                axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
+        
+        fig.suptitle('Compass heading')
+        # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
+        with stage('savefig'):
+            save_chart(chart_path('pie_compass_heading', page), template)
+        show_chart(template)
     
-    for i, interval in enumerate(list_of_intervals):
-        corr_matrix = interval.corr()
-        # We need to exclude the last row and column for getting rid of the blank space
-        corr_matrix = corr_matrix.iloc[:-1, :-1]  
-        im = axs[i].matshow(corr_matrix, cmap='coolwarm')
-        fig.colorbar(im, ax=axs[i]) 
+def draw_correlations(template, axs, matrices: list):
+    # matrices is a list of (title, correlation matrix), one for each axis
+    for ax, (title, corr_matrix) in zip(axs, matrices):
+        im = template.matshow(ax, 'correlation', corr_matrix, cmap='coolwarm')
+        template.colorbar(ax, 'colorbar', im)
         # Set the ticks of the x and y axis as the column names
-        axs[i].set_xticks(np.arange(len(corr_matrix.columns)), labels=corr_matrix.columns)
-        axs[i].set_yticks(np.arange(len(corr_matrix.columns)), labels=corr_matrix.columns)
-        axs[i].set_title('Interval {}'.format(interval['interval'].iloc[0]))
+        ax.set_xticks(np.arange(len(corr_matrix.columns)), labels=corr_matrix.columns)
+        ax.set_yticks(np.arange(len(corr_matrix.columns)), labels=corr_matrix.columns)
+        ax.set_title(title)
+        ax.set_xticklabels(ax.get_xticklabels(), rotation=-45, ha='right')
 
-    axs[0].set_xticklabels(axs[0].get_xticklabels(), rotation=-45, ha='right')
-    axs[1].set_xticklabels(axs[1].get_xticklabels(), rotation=-45, ha='right')
-    axs[2].set_xticklabels(axs[2].get_xticklabels(), rotation=-45, ha='right')
+def correlations(list_of_intervals: list):
+    for page, intervals in paginate(list_of_intervals):
+        template = FIGURES.subplots('correlations', 1, len(intervals), figsize=(8, 5))
+        fig, axs = template.fig, template.axs
+        # The columns in CORRELATION_EXCLUDE are left out by name
+        matrices = []
+        for interval in intervals:
+            with stage('compute', interval=interval['interval'].iloc[0]):
+                matrices.append(('Interval {}'.format(interval['interval'].iloc[0]), interval_correlation(interval, CORRELATION_EXCLUDE)))
+        with stage('draw'):
+            draw_correlations(template, axs[0], matrices)
 
+        fig.suptitle('Correlation Heatmap', fontsize=16)
+        plt.subplots_adjust(wspace=0.45)
+        # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
+        with stage('savefig'):
+            save_chart(chart_path('correlation_heatmap', page), template)
+        show_chart(template)
 
-    fig.suptitle('Correlation Heatmap', fontsize=16)
-    plt.subplots_adjust(wspace=0.45)
-    # plt.get_current_fig_manager().window.state('zoomed') # Only works on Windows
-    plt.savefig('charts/correlation_heatmap.png', dpi=200)
-    plt.show()
+def streamed_correlations(path: str):
+    # Correlation heatmaps of a log that doesn't fit in memory, the CSV is read in chunks
+    result = stream_correlations(path, CORRELATION_EXCLUDE)
+    if not result.intervals:
+        print('{} has no valid rows, there are no correlations to draw'.format(path))
+        return
+    matrices = [('Interval {}'.format(number), corr_matrix) for number, corr_matrix in result.interval_correlations().items()]
+    for page, page_matrices in paginate(matrices):
+        template = FIGURES.subplots('correlations', 1, len(page_matrices), figsize=(8, 5))
+        draw_correlations(template, template.axs[0], page_matrices)
+        template.fig.suptitle('Correlation Heatmap', fontsize=16)
+        plt.subplots_adjust(wspace=0.45)
+        with stage('savefig'):
+            save_chart(chart_path('correlation_heatmap_stream', page), template)
+        show_chart(template)
+    template = FIGURES.subplots('correlation_global', figsize=(6, 5))
+    draw_correlations(template, template.axs[0], [('All intervals', result.correlation())])
+    template.fig.suptitle('Correlation Heatmap', fontsize=16)
+    with stage('savefig'):
+        save_chart(os.path.join(CHARTS_DIR, 'correlation_heatmap_global.' + CHART_FORMAT), template, bbox_inches ="tight")
+    show_chart(template)
     
-def print_menu():
+def print_menu(background: bool = False):
     print('Select the data you want to see:')
     print('1. All data')
     print('2. Temperature')
@@ -205,34 +363,218 @@ def print_menu():
     print('6. Compass heading')
     print('7. Correlation matrix')
     print('8. Exit')
+    if background:
+        print('9. Queue status')
+        print('10. Cancel a queued job')
     try: 
         return int(input('Option: '))
     except ValueError:
         print('Please enter a number')
-        return print_menu()
+        return print_menu(background)
+
+def print_queue(queue: RenderQueue):
+    for job_id, name, state, seconds in queue.status():
+        print('  Job {:<3} {:<26} {:<9} {:6.1f}s'.format(job_id, name, state, seconds))
+    if not queue.jobs:
+        print('  The queue is empty')
+
+def job_finished(job):
+    # Called from a background thread when a chart is saved
+    if job.state() == 'failed':
+        print('\nJob {} ({}) failed: {}'.format(job.id, job.key, job.future.exception()))
+    else:
+        print('\nJob {} ({}) saved in {:.1f}s'.format(job.id, job.key, job.seconds()))
 
-def menu():
+def menu(background: bool = False, workers: int = None):
+    # In background mode the charts are not shown, every option is a job that saves the chart
+    # in CHARTS_DIR while the menu keeps working
+    queue = None
+    if background:
+        # The log is loaded before the workers are made, so they get it from this process and they don't
+        # all read (or build) the cache at the same time
+        get_data()
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                       initargs=(CHARTS_DIR, MAX_POINTS, CORRELATION_EXCLUDE, SHOW_EVENTS, CHART_FORMAT))
+        queue = RenderQueue(executor, workers, on_finish=job_finished)
     while True:
-        option = print_menu()
-        if option == 1:
-            all_data(list_of_intervals)
-        elif option == 2:
-            historic_temperature(list_of_intervals)
-        elif option == 3:
-            historic_light(list_of_intervals)
-        elif option == 4:
-            historic_sound(list_of_intervals)
-        elif option == 5:
-            historic_acceleration(list_of_intervals)
-        elif option == 6:
-            historic_compass_heading(list_of_intervals)
-        elif option == 7:
-            correlations(list_of_intervals)
-        elif option == 8:
+        option = print_menu(background)
+        if option == 8:
+            if queue is not None:
+                if queue.pending():
+                    print('Waiting for {} jobs...'.format(queue.pending()))
+                queue.shutdown()
             print('Exiting...')
             break
+        elif 1 <= option <= len(CHARTS):
+            # The options are in the same order as CHARTS
+            name = list(CHARTS)[option - 1]
+            if queue is None:
+                with action(name):
+                    CHARTS[name](DATA.intervals)
+            else:
+                job, merged = queue.submit(name, render_chart, name)
+                if merged:
+                    print('{} is already in the queue as job {}'.format(name, job.id))
+                else:
+                    print('Job {} queued: {}'.format(job.id, name))
+        elif queue is not None and option == 9:
+            print_queue(queue)
+        elif queue is not None and option == 10:
+            try:
+                job_id = int(input('Job to cancel: '))
+            except ValueError:
+                continue
+            if queue.cancel(job_id):
+                print('Job {} cancelled'.format(job_id))
+            else:
+                print('Job {} can\'t be cancelled (it has started or doesn\'t exist)'.format(job_id))
         else:
             pass
-        
-menu()
+
+# Charts in the same order as the menu, used by the batch mode
+CHARTS = {
+    'all_data': all_data,
+    'historic_temperature': historic_temperature,
+    'historic_light': historic_light,
+    'historic_sound': historic_sound,
+    'historic_acceleration': historic_acceleration,
+    'historic_compass_heading': historic_compass_heading,
+    'correlations': correlations,
+}
+# Name of the files saved by each paged chart
+CHART_FILES = {
+    'historic_temperature': 'scatter_temperature',
+    'historic_light': 'barh_light',
+    'historic_sound': 'hist_sound_level',
+    'historic_acceleration': 'plot_accel',
+    'historic_compass_heading': 'pie_compass_heading',
+    'correlations': 'correlation_heatmap',
+}
+def chart_params() -> dict:
+    # Everything that changes the charts apart from the data, a change here renders all of them again
+    return {'dpi': 200, 'intervals_per_page': INTERVALS_PER_PAGE, 'style': 'fivethirtyeight', 'max_points': MAX_POINTS,
+            'correlation_exclude': CORRELATION_EXCLUDE, 'show_events': SHOW_EVENTS, 'format': CHART_FORMAT}
+
+def chart_outputs(name: str, hashes: list) -> list:
+    # List of (page, file name, key) of every file the chart saves
+    if name == 'all_data':
+        return [(page, 'plot_alldata{}.{}'.format(interval['interval'].iloc[0], CHART_FORMAT),
+                 output_key(all_data, chart_params(), [hashes[page - 1]]))
+                for page, interval in enumerate(DATA.intervals, start=1)]
+    outputs = []
+    for page, start in enumerate(range(0, len(hashes), INTERVALS_PER_PAGE), start=1):
+        outputs.append((page, chart_file(CHART_FILES[name], page),
+                        output_key(CHARTS[name], chart_params(), hashes[start:start + INTERVALS_PER_PAGE])))
+    return outputs
+
+def init_batch_worker(out_dir: str, max_points: int = None, correlation_exclude: list = None, show_events: bool = False,
+                      chart_format: str = 'png'):
+    # Each worker draws without windows (Agg backend) and saves the charts in out_dir
+    global CHARTS_DIR, SHOW_CHARTS, MAX_POINTS, CORRELATION_EXCLUDE, SHOW_EVENTS, CHART_FORMAT
+    plt.switch_backend('Agg')
+    CHARTS_DIR = out_dir
+    CHART_FORMAT = chart_format
+    FIGURES.enabled = True
+    SHOW_CHARTS = False
+    MAX_POINTS = max_points
+    SHOW_EVENTS = show_events
+    if correlation_exclude is not None:
+        CORRELATION_EXCLUDE = correlation_exclude
+
+def render_chart(name: str, pages: list = None) -> tuple:
+    global PAGES_TO_RENDER
+    PAGES_TO_RENDER = None if pages is None else set(pages)
+    start = time.perf_counter()
+    try:
+        with action(name):
+            CHARTS[name](DATA.intervals)
+    finally:
+        PAGES_TO_RENDER = None
+    return name, time.perf_counter() - start
+
+def render_all(out_dir: str, workers: int = None, force: bool = False):
+    # Render the seven charts at the same time, one chart per process.
+    # The manifest keeps the key of every saved file, the pages whose key didn't change are skipped
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    manifest = {} if force else load_manifest(out_dir)
+    hashes = [interval_hash(interval) for interval in DATA.intervals]
+    jobs = {}
+    for name in CHARTS:
+        for page, file_name, key in chart_outputs(name, hashes):
+            if not is_up_to_date(manifest, out_dir, file_name, key):
+                jobs.setdefault(name, []).append((page, file_name, key))
+    for name in CHARTS:
+        if name not in jobs:
+            print('{:<26} {:>7}'.format(name, 'skipped'))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                 initargs=(out_dir, MAX_POINTS, CORRELATION_EXCLUDE, SHOW_EVENTS, CHART_FORMAT)) as executor:
+            futures = {executor.submit(render_chart, name, [page for page, _, _ in outputs]): name
+                       for name, outputs in jobs.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    _, seconds = future.result()
+                except Exception as error:
+                    # One chart that fails doesn't stop the others, and its files are rendered again next time
+                    print('{:<26} {:>7}: {}'.format(name, 'failed', error))
+                    continue
+                # The manifest is only updated for the charts that were saved without errors
+                for _, file_name, key in jobs[name]:
+                    manifest[file_name] = key
+                print('{:<26} {:6.2f}s ({} files)'.format(name, seconds, len(jobs[name])))
+    finally:
+        # Also when a worker dies or the run is stopped, so the charts that were saved are not rendered again
+        save_manifest(out_dir, manifest)
+    print('{:<26} {:6.2f}s'.format('Total', time.perf_counter() - start))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Data analysis of Micro:bit')
+    parser.add_argument('--background', action='store_true',
+                        help='the menu saves the charts in background processes instead of showing them')
+    parser.add_argument('--render-all', action='store_true', help='render all the charts without windows and exit')
+    parser.add_argument('--out', default=CHARTS_DIR, help='folder where the charts are saved')
+    parser.add_argument('--format', choices=['png', 'svg'], default=CHART_FORMAT, help='format of the saved charts')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all the cores)')
+    parser.add_argument('--max-points', type=int, default=None, help='decimate the time series to this number of points per line')
+    parser.add_argument('--corr-exclude', nargs='*', metavar='COLUMN', default=None,
+                        help="columns left out of the correlation heatmaps (for example 'Time (seconds)' sample-id)")
+    parser.add_argument('--correlations-from', metavar='CSV', default=None,
+                        help='draw the correlation heatmaps of a big CSV reading it in chunks, and exit')
+    parser.add_argument('--events', action='store_true', help='draw the motion and heading events on the acceleration chart')
+    parser.add_argument('--events-out', metavar='CSV', default=None, help='save the table of sound, motion and heading events to this file')
+    parser.add_argument('--stats', metavar='CSV', default=None, help='save the statistics of every interval and sensor to this file')
+    parser.add_argument('--profile', metavar='MODES', default=None,
+                        help='timers, cprofile and/or tracemalloc separated by commas (also MICROBIT_PROFILE)')
+    parser.add_argument('--force', action='store_true', help='render all the charts even if their data did not change')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.profile is not None:
+        configure(args.profile)
+    MAX_POINTS = args.max_points
+    if args.corr_exclude is not None:
+        # The interval number is never a sensor
+        CORRELATION_EXCLUDE = ['interval'] + args.corr_exclude
+    SHOW_EVENTS = args.events
+    CHART_FORMAT = args.format
+    if args.stats:
+        export_stats(DATA.stats, args.stats)
+    if args.events_out:
+        export_events(DATA.events, args.events_out)
+    if args.correlations_from:
+        SHOW_CHARTS = False
+        FIGURES.enabled = True
+        CHARTS_DIR = args.out
+        os.makedirs(CHARTS_DIR, exist_ok=True)
+        streamed_correlations(args.correlations_from)
+    elif args.render_all:
+        render_all(args.out, args.workers, args.force)
+    else:
+        CHARTS_DIR = args.out
+        os.makedirs(CHARTS_DIR, exist_ok=True)
+        menu(args.background, args.workers)
 
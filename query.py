@@ -0,0 +1,133 @@
+import os
+import warnings
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from bin_index import build_bin_index
+from data_loader import CACHE_DIR, CSV_PATH, QUARANTINE_FILE, SENSORS, cache_folder, interval_bounds, load_cached, quarantine_report
+from events import detect_events
+from instrumentation import stage
+from interval_stats import compute_stats
+from rollups import build_rollups
+
+# Queries over one log that is loaded the first time it is used, so importing main.py reads nothing:
+#   log = SensorLog('data/microbit_sensor.csv')
+#   log.select(intervals=[1, 3], time=(60, 600), sensors=['temp', 'light'])
+# select returns one dataframe per interval and they are slices of the loaded data (no copies).
+# The rows of an interval are found in the offset table (start and stop of every interval) and the
+# time range with a binary search on the time of that interval, which only grows inside an interval.
+# The statistics, counts, events and rollups of the charts are also computed once, the first time they are used.
+
+# Columns that every selection keeps, the sensors are chosen with sensors=[...]
+KEY_COLUMNS = ['Time (seconds)', 'sample-id', 'interval']
+
+
+class SensorLog:
+    def __init__(self, path: str = CSV_PATH, cache_dir: str = CACHE_DIR, frame: pd.DataFrame = None):
+        # frame is for data that is already in memory (the benchmark), then path is only its name
+        self.path = path
+        self.cache_dir = cache_dir
+        if frame is not None:
+            self.__dict__['frame'] = frame
+
+    @cached_property
+    def frame(self) -> pd.DataFrame:
+        with stage('load'):
+            frame = load_cached(self.path, self.cache_dir)
+        # The rows that could not be read (cut lines, text in a number column...) are left out and saved in the quarantine file
+        skipped = quarantine_report(self.path, self.cache_dir)
+        if skipped:
+            warnings.warn('{} rows of {} were left out ({}), see {}'.format(
+                sum(skipped.values()), self.path, ', '.join('{} {}'.format(count, kind) for kind, count in skipped.items()),
+                os.path.join(cache_folder(self.path, self.cache_dir), QUARANTINE_FILE)))
+        return frame
+
+    @cached_property
+    def offsets(self) -> pd.DataFrame:
+        # One row per interval: its number, the first row, the row after the last one and whether its time is sorted
+        with stage('group'):
+            bounds = interval_bounds(self.frame['interval'].to_numpy())
+            starts, stops = bounds[:-1], bounds[1:]
+            keep = stops > starts
+            starts, stops = starts[keep], stops[keep]
+            time = self.frame['Time (seconds)'].to_numpy()
+            # Rows where the time goes back, the first row of an interval doesn't count
+            drops = np.flatnonzero(time[1:] < time[:-1]) + 1
+            unsorted = np.zeros(len(starts), dtype=bool)
+            if len(drops) and len(starts):
+                owners = np.searchsorted(starts, drops, side='right') - 1
+                unsorted[owners[drops != starts[owners]]] = True
+            numbers = self.frame['interval'].to_numpy()[starts]
+            return pd.DataFrame({'start': starts, 'stop': stops, 'sorted': ~unsorted}, index=pd.Index(numbers, name='interval'))
+
+    @cached_property
+    def intervals(self) -> list:
+        # Every interval as a slice of the loaded dataframe, in the order of the file
+        return [self.frame.iloc[start:stop] for start, stop in zip(self.offsets['start'], self.offsets['stop'])]
+
+    def numbers(self) -> list:
+        return self.offsets.index.tolist()
+
+    def select(self, intervals: list = None, time: tuple = None, sensors: list = None) -> list:
+        # intervals are interval numbers (all of them if None), time is (first, last) in seconds with both ends
+        # included and either of them can be None, sensors are the columns kept apart from KEY_COLUMNS.
+        # The intervals without rows in the time range are left out
+        offsets = self.offsets
+        if intervals is None:
+            intervals = offsets.index
+        unknown = [number for number in intervals if number not in offsets.index]
+        if unknown:
+            raise KeyError('Unknown intervals: {}'.format(', '.join(str(number) for number in unknown)))
+        columns = None
+        if sensors is not None:
+            wrong = [sensor for sensor in sensors if sensor not in SENSORS]
+            if wrong:
+                raise ValueError('Unknown sensors: {}'.format(', '.join(wrong)))
+            columns = KEY_COLUMNS + [sensor for sensor in SENSORS if sensor in sensors]
+        first, last = time if time is not None else (None, None)
+        values = self.frame['Time (seconds)'].to_numpy()
+        result = []
+        for number in intervals:
+            start, stop, is_sorted = offsets.loc[number, ['start', 'stop', 'sorted']]
+            start, stop = int(start), int(stop)
+            if time is not None and not is_sorted:
+                # A clock that went back: the rows are chosen with a mask and they are a copy
+                seconds = values[start:stop]
+                mask = np.ones(stop - start, dtype=bool)
+                if first is not None:
+                    mask &= seconds >= first
+                if last is not None:
+                    mask &= seconds <= last
+                selection = self.frame.iloc[start:stop][mask]
+            else:
+                if first is not None:
+                    start += int(np.searchsorted(values[start:stop], first, side='left'))
+                if last is not None:
+                    stop = start + int(np.searchsorted(values[start:stop], last, side='right'))
+                selection = self.frame.iloc[start:stop]
+            if len(selection) == 0:
+                continue
+            result.append(selection if columns is None else selection[columns])
+        return result
+
+    @cached_property
+    def stats(self) -> pd.DataFrame:
+        with stage('compute'):
+            return compute_stats(self.frame)
+
+    @cached_property
+    def bins(self):
+        with stage('compute'):
+            return build_bin_index(self.frame)
+
+    @cached_property
+    def events(self) -> pd.DataFrame:
+        with stage('compute'):
+            return detect_events(self.frame)
+
+    @cached_property
+    def rollups(self):
+        with stage('compute'):
+            return build_rollups(self.frame)
@@ -0,0 +1,47 @@
+import hashlib
+import inspect
+import json
+import os
+
+# Remember which data was used for every chart file so only the charts whose data changed are rendered again
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def interval_hash(interval) -> str:
+    # Hash of the values of every column of the interval
+    digest = hashlib.blake2b(digest_size=16)
+    for column in interval.columns:
+        digest.update(column.encode())
+        digest.update(interval[column].to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def output_key(function, params: dict, hashes: list) -> str:
+    # A chart file has to be rendered again when its data, its parameters or the code of the chart change
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(inspect.getsource(function).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    for interval_digest in hashes:
+        digest.update(interval_digest.encode())
+    return digest.hexdigest()
+
+
+def load_manifest(out_dir: str) -> dict:
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(out_dir: str, manifest: dict):
+    # Write to a temporary file first so a manifest is never left half written
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_up_to_date(manifest: dict, out_dir: str, file_name: str, key: str) -> bool:
+    return manifest.get(file_name) == key and os.path.exists(os.path.join(out_dir, file_name))
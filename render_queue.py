@@ -0,0 +1,112 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+# Queue of chart jobs that run in the background, so the menu doesn't wait for each chart.
+# A job that asks for the same thing as one that is still queued or running is merged with it.
+# The jobs are only given to the executor when a worker is free, until then they can be cancelled.
+
+
+class Job:
+    def __init__(self, job_id: int, key, function, args: tuple):
+        self.id = job_id
+        self.key = key
+        self.function = function
+        self.args = args
+        self.future = None
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+        self.finished = None
+
+    def state(self) -> str:
+        if self.cancelled:
+            return 'cancelled'
+        if self.future is None:
+            return 'queued'
+        if not self.future.done():
+            return 'running'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.submitted
+
+
+class RenderQueue:
+    def __init__(self, executor, slots: int, on_finish=None):
+        # slots is the number of jobs given to the executor at the same time (its number of workers).
+        # on_finish(job) is called from a background thread when a job ends
+        self.executor = executor
+        self.slots = slots
+        self.on_finish = on_finish
+        self.jobs = []
+        self._waiting = deque()
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args) -> tuple:
+        # Returns the job and True if it was merged with a job that was already queued or running
+        with self._lock:
+            for job in self.jobs:
+                if job.key == key and job.state() in ('queued', 'running'):
+                    return job, True
+            job = Job(next(self._ids), key, function, args)
+            self.jobs.append(job)
+            self._waiting.append(job)
+            started = self._dispatch()
+        self._watch(started)
+        return job, False
+
+    def _dispatch(self) -> list:
+        # Called with the lock taken, returns the jobs given to the executor
+        started = []
+        while self._waiting and self._running < self.slots:
+            job = self._waiting.popleft()
+            job.future = self.executor.submit(job.function, *job.args)
+            self._running += 1
+            started.append(job)
+        return started
+
+    def _watch(self, jobs: list):
+        # Called without the lock: a future that is already done runs its callback here,
+        # and the callback takes the lock
+        for job in jobs:
+            job.future.add_done_callback(lambda future, job=job: self._finished(job))
+
+    def _finished(self, job: Job):
+        job.finished = time.perf_counter()
+        with self._lock:
+            self._running -= 1
+            started = self._dispatch()
+        self._watch(started)
+        if self.on_finish is not None:
+            self.on_finish(job)
+
+    def cancel(self, job_id: int) -> bool:
+        # Only the jobs that haven't started can be cancelled
+        with self._lock:
+            for job in self._waiting:
+                if job.id == job_id:
+                    self._waiting.remove(job)
+                    job.cancelled = True
+                    job.finished = time.perf_counter()
+                    return True
+        return False
+
+    def pending(self) -> int:
+        return sum(job.state() in ('queued', 'running') for job in self.jobs)
+
+    def status(self) -> list:
+        return [(job.id, job.key, job.state(), job.seconds()) for job in self.jobs]
+
+    def shutdown(self):
+        # Wait until all the queued jobs are done
+        while True:
+            with self._lock:
+                futures = [job.future for job in self.jobs if job.future is not None and not job.future.done()]
+                if not futures and not self._waiting:
+                    break
+            for future in futures:
+                future.exception()
+        self.executor.shutdown(wait=True)
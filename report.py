@@ -0,0 +1,203 @@
+import argparse
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from data_loader import quarantine_report
+from dataset import SensorDataset, describe_file, find_files
+
+# Static report of a log that can be opened without a server or copied anywhere:
+#   assets/        the charts of main.py, rendered in parallel and only when their data changed (render_all)
+#   summary.json   the statistics and the number of events of every interval
+#   index.html     a page with all the charts and the table of statistics
+#   python report.py --out report
+#   python report.py --devices data/fleet --out reports     one report for every CSV and an index of all of them
+#   python report.py --fleet data/fleet --out fleet           one report that compares all the devices
+
+ASSETS_DIR = 'assets'
+SUMMARY_FILE = 'summary.json'
+INDEX_FILE = 'index.html'
+# Same titles as the sections of the README
+TITLES = {
+    'all_data': 'All data',
+    'historic_temperature': 'Temperature',
+    'historic_light': 'Light',
+    'historic_sound': 'Sound',
+    'historic_acceleration': 'Acceleration',
+    'historic_compass_heading': 'Compass Heading',
+    'correlations': 'Correlation Heatmap',
+    'fleet_temperature': 'Temperature',
+    'fleet_light': 'Light',
+    'fleet_sound': 'Sound',
+    'fleet_acceleration': 'Acceleration',
+    'fleet_compass_heading': 'Compass Heading',
+}
+# Table with one row per device, file and interval of the fleet report
+FLEET_FILE = 'fleet.csv'
+STYLE = ('body {font-family: sans-serif; margin: 2em; background: #f0f0f0} img {max-width: 100%} '
+         'table {border-collapse: collapse; font-size: 0.8em} td, th {border: 1px solid #ccc; padding: 0.2em 0.5em}')
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    # The file keeps its date when the content is the same, and it is never left half written
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            if file.read() == text:
+                return False
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def _number(value):
+    # NaN (the std of an interval with one row) is not valid JSON
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def summary(main) -> dict:
+    from interval_stats import summary_table
+
+    table = summary_table(main.DATA.stats)
+    # Number of events of every kind, with a column for every kind even if there are none
+    counts = main.DATA.events.groupby(['interval', 'event'], observed=False).size().unstack(fill_value=0)
+    intervals = []
+    for interval in main.DATA.intervals:
+        number = int(interval['interval'].iloc[0])
+        sensors = table.xs(number, level='interval')
+        intervals.append({
+            'interval': number,
+            'rows': len(interval),
+            'start_time': _number(interval['Time (seconds)'].iloc[0]),
+            'end_time': _number(interval['Time (seconds)'].iloc[-1]),
+            'events': {kind: int(counts.at[number, kind]) if number in counts.index else 0 for kind in counts.columns},
+            'sensors': {sensor: {stat: _number(value) for stat, value in values.items()}
+                        for sensor, values in sensors.iterrows()},
+        })
+    return {'source': main.DATA_PATH, 'rows': len(main.DATA.frame), 'quarantined': quarantine_report(main.DATA_PATH),
+            'intervals': intervals}
+
+
+def index_page(main, title: str) -> str:
+    from interval_stats import summary_table
+    from render_manifest import interval_hash
+
+    hashes = [interval_hash(interval) for interval in main.DATA.intervals]
+    sections = []
+    for name in main.CHARTS:
+        images = ['<img src="{}/{}" loading="lazy" alt="{}">'.format(ASSETS_DIR, html.escape(file_name), html.escape(file_name))
+                  for _, file_name, _ in main.chart_outputs(name, hashes)]
+        sections.append('<h2>{}</h2>\n{}'.format(TITLES.get(name, name), '\n'.join(images)))
+    stats = summary_table(main.DATA.stats).to_html(float_format='{:.2f}'.format, na_rep='')
+    return ('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>{0}</title><style>{1}</style></head>\n'
+            '<body>\n<h1>{0}</h1>\n<p>{2} rows, {3} intervals. <a href="{4}">Statistics in JSON</a></p>\n{5}\n'
+            '<h2>Statistics</h2>\n{6}\n</body>\n</html>\n').format(
+        html.escape(title), STYLE, len(main.DATA.frame), len(main.DATA.intervals), SUMMARY_FILE,
+        '\n'.join(sections), stats)
+
+
+def write_report(out_dir: str, workers: int = None, force: bool = False, chart_format: str = 'png',
+                 data_path: str = None) -> dict:
+    # main takes the path of its log when it is imported, so it has to be set before (the chart workers read it too)
+    if data_path is not None:
+        os.environ['MICROBIT_DATA'] = data_path
+    import main
+
+    main.CHART_FORMAT = chart_format
+    os.makedirs(out_dir, exist_ok=True)
+    main.render_all(os.path.join(out_dir, ASSETS_DIR), workers, force)
+    result = summary(main)
+    write_if_changed(os.path.join(out_dir, SUMMARY_FILE), json.dumps(result, indent=2))
+    title = 'Micro:bit report - {}'.format(os.path.basename(main.DATA_PATH))
+    write_if_changed(os.path.join(out_dir, INDEX_FILE), index_page(main, title))
+    return {'source': main.DATA_PATH, 'rows': result['rows'], 'intervals': len(result['intervals'])}
+
+
+def report_name(path: str) -> str:
+    info = describe_file(path)
+    if pd.isna(info['date']):
+        return info['device']
+    return '{}_{}'.format(info['device'], info['date'].strftime('%Y-%m-%d'))
+
+
+def write_reports(source: str, out_dir: str, workers: int = None, force: bool = False, chart_format: str = 'png'):
+    # One report for every CSV. Each one runs in a new process (spawn) because main keeps the data of one log,
+    # the charts of each report are already rendered in parallel
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    reports = []
+    for path in find_files(source):
+        name = report_name(path)
+        print('Report {}'.format(name))
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            item = executor.submit(write_report, os.path.join(out_dir, name), workers, force, chart_format, path).result()
+        reports.append((name, item))
+    rows = ['<tr><td><a href="{0}/{1}">{0}</a></td><td>{2}</td><td>{3}</td></tr>'.format(
+        html.escape(name), INDEX_FILE, item['rows'], item['intervals']) for name, item in reports]
+    write_if_changed(os.path.join(out_dir, INDEX_FILE), (
+        '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Micro:bit reports</title><style>{}</style></head>\n'
+        '<body>\n<h1>Micro:bit reports</h1>\n<table>\n<tr><th>Log</th><th>Rows</th><th>Intervals</th></tr>\n{}\n'
+        '</table>\n</body>\n</html>\n').format(STYLE, '\n'.join(rows)))
+    print('{} reports in {:.2f}s'.format(len(reports), time.perf_counter() - start))
+
+
+def write_fleet_report(source: str, out_dir: str, workers: int = None, chart_format: str = 'png') -> dict:
+    # One report with the charts of all the devices side by side. The files are summarized in parallel
+    # (loading them is the slow part) and the charts are drawn from the summaries, a few numbers per interval,
+    # so it takes about the same time as the report of one device
+    from fleet import FLEET_CHARTS, device_order, render_fleet
+
+    start = time.perf_counter()
+    table = SensorDataset(source).summaries(workers)
+    print('{:<26} {:6.2f}s ({} files)'.format('Summaries', time.perf_counter() - start, table['file'].nunique()))
+    os.makedirs(out_dir, exist_ok=True)
+    render_fleet(table, os.path.join(out_dir, ASSETS_DIR), workers, chart_format)
+    write_if_changed(os.path.join(out_dir, FLEET_FILE), table.to_csv(index=False, date_format='%Y-%m-%d'))
+    sections = ['<h2>{0}</h2>\n<img src="{1}/{2}.{3}" loading="lazy" alt="{2}">'.format(TITLES[name], ASSETS_DIR, name, chart_format)
+                for name in FLEET_CHARTS]
+    # Every device with the mean of its intervals, weighted by their rows
+    weights = table['rows'].astype(np.float64)
+    means = table[['temp_mean', 'light_fraction', 'sound_mean', 'sound_loud', 'motion_mean']].mul(weights, axis=0)
+    devices = means.groupby(table['device']).sum().div(weights.groupby(table['device']).sum(), axis=0)
+    devices.insert(0, 'files', table.groupby('device')['file'].nunique())
+    devices.insert(1, 'intervals', table.groupby('device').size())
+    devices.insert(2, 'rows', table.groupby('device')['rows'].sum())
+    devices = devices.loc[device_order(devices.index)]
+    write_if_changed(os.path.join(out_dir, INDEX_FILE), (
+        '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Micro:bit fleet</title><style>{}</style></head>\n'
+        '<body>\n<h1>Micro:bit fleet</h1>\n<p>{} devices, {} files, {} intervals. <a href="{}">Summary of every interval in CSV</a></p>\n'
+        '{}\n<h2>Devices</h2>\n{}\n</body>\n</html>\n').format(
+        STYLE, len(devices), table['file'].nunique(), len(table), FLEET_FILE, '\n'.join(sections),
+        devices.to_html(float_format='{:.2f}'.format, na_rep='')))
+    print('{:<26} {:6.2f}s'.format('Total', time.perf_counter() - start))
+    return {'devices': len(devices), 'files': int(table['file'].nunique()), 'intervals': len(table)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Static HTML report of the Micro:bit charts')
+    parser.add_argument('--out', default='report', help='folder of the report')
+    parser.add_argument('--devices', metavar='SOURCE', default=None,
+                        help='folder or glob pattern with one CSV per device, a report is written for each one')
+    parser.add_argument('--fleet', metavar='SOURCE', default=None,
+                        help='folder or glob pattern with one CSV per device, one report compares all of them')
+    parser.add_argument('--format', choices=['png', 'svg'], default='png', help='format of the charts')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all the cores)')
+    parser.add_argument('--force', action='store_true', help='render all the charts even if their data did not change')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.fleet:
+        write_fleet_report(args.fleet, args.out, args.workers, args.format)
+    elif args.devices:
+        write_reports(args.devices, args.out, args.workers, args.force, args.format)
+    else:
+        write_report(args.out, args.workers, args.force, args.format)
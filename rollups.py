@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import CHUNK_SIZE, SENSORS, read_interval_chunks
+
+# Rollup pyramid: minimum, maximum, mean and count of every sensor in buckets of 1 minute, 10 minutes,
+# 1 hour and 1 day of each interval. It is updated with every chunk that arrives, and the charts of long
+# captures use the coarsest level that still has a point for every pixel instead of all the samples.
+
+# Size of the buckets of every level in seconds, each one is a multiple of the previous one
+LEVELS = [60, 600, 3600, 86400]
+STATS = ['min', 'max', 'sum', 'count']
+# How the stats of two parts of the same bucket are joined
+COMBINE = {'min': 'min', 'max': 'max', 'sum': 'sum', 'count': 'sum'}
+
+
+def _rollup(keys: pd.DataFrame, values: pd.DataFrame, columns: list) -> pd.DataFrame:
+    # Stats of the rows grouped by (interval, bucket), with (sensor, stat) columns
+    grouped = pd.concat([keys, values], axis=1).groupby(['interval', 'bucket'], sort=True)
+    result = grouped[columns].agg(['min', 'max', 'sum', 'count'])
+    return result.astype({(column, 'sum'): np.float64 for column in columns})
+
+
+def _combine(table: pd.DataFrame) -> pd.DataFrame:
+    # Join the rows with the same (interval, bucket)
+    return table.groupby(level=['interval', 'bucket'], sort=True).agg(
+        {column: COMBINE[column[1]] for column in table.columns})
+
+
+def _append(table: pd.DataFrame, partial: pd.DataFrame) -> pd.DataFrame:
+    # The data arrives in order, so only the buckets of the table from the first bucket of partial on
+    # can be in both tables. Only that tail is joined again, the rest of the table is kept as it is
+    intervals = table.index.get_level_values('interval').to_numpy()
+    buckets = table.index.get_level_values('bucket').to_numpy()
+    first_interval, first_bucket = partial.index[0]
+    low = np.searchsorted(intervals, first_interval, side='left')
+    high = np.searchsorted(intervals, first_interval, side='right')
+    cut = low + np.searchsorted(buckets[low:high], first_bucket, side='left')
+    if cut == len(table):
+        return pd.concat([table, partial])
+    return pd.concat([table.iloc[:cut], _combine(pd.concat([table.iloc[cut:], partial]))])
+
+
+def choose_level(span_seconds: float, pixels: int, levels: list = LEVELS):
+    # The coarsest level that still has at least one bucket for every pixel,
+    # or None when even the finest level has fewer buckets than pixels (the raw samples are better then).
+    # It only needs the sizes of the levels, so the pyramid is not built to ask it
+    chosen = None
+    for level in levels:
+        if span_seconds / level >= pixels:
+            chosen = level
+    return chosen
+
+
+class RollupPyramid:
+    def __init__(self, columns: list = SENSORS, levels: list = LEVELS):
+        self.columns = list(columns)
+        self.levels = list(levels)
+        self.tables = {level: None for level in self.levels}
+
+    def update(self, chunk: pd.DataFrame):
+        if len(chunk) == 0:
+            return
+        # The finest level is built from the rows and every other level from the level before it,
+        # so a bucket of 10 minutes is the sum of its 10 buckets of 1 minute
+        seconds = chunk['Time (seconds)'].to_numpy(dtype=np.float64)
+        keys = pd.DataFrame({'interval': chunk['interval'].to_numpy().astype(np.int64),
+                             'bucket': np.floor(seconds / self.levels[0]).astype(np.int64)}, index=chunk.index)
+        partial = _rollup(keys, chunk[self.columns].astype(np.float64), self.columns)
+        for i, level in enumerate(self.levels):
+            if i > 0:
+                ratio = level // self.levels[i - 1]
+                index = partial.index
+                partial = partial.set_axis(pd.MultiIndex.from_arrays(
+                    [index.get_level_values('interval'), index.get_level_values('bucket') // ratio],
+                    names=['interval', 'bucket']))
+                partial = _combine(partial)
+            if self.tables[level] is None:
+                self.tables[level] = partial
+            else:
+                self.tables[level] = _append(self.tables[level], partial)
+
+    def level(self, seconds: int, interval=None, column: str = None) -> pd.DataFrame:
+        # Table of one level with the mean added, and the start of every bucket in seconds
+        table = self.tables[seconds]
+        if table is None:
+            return pd.DataFrame()
+        if interval is not None:
+            table = table.xs(interval, level='interval', drop_level=False)
+        columns = self.columns if column is None else [column]
+        result = {}
+        for name in columns:
+            for stat in ['min', 'max', 'count']:
+                result[(name, stat)] = table[(name, stat)]
+            result[(name, 'mean')] = table[(name, 'sum')] / table[(name, 'count')]
+        result = pd.DataFrame(result, index=table.index)
+        result['start'] = result.index.get_level_values('bucket') * seconds
+        return result
+
+    def choose_level(self, span_seconds: float, pixels: int):
+        return choose_level(span_seconds, pixels, self.levels)
+
+
+def build_rollups(dataframe: pd.DataFrame, columns: list = SENSORS) -> RollupPyramid:
+    pyramid = RollupPyramid(columns)
+    pyramid.update(dataframe)
+    return pyramid
+
+
+def stream_rollups(path: str, chunksize: int = CHUNK_SIZE, columns: list = SENSORS) -> RollupPyramid:
+    pyramid = RollupPyramid(columns)
+    for chunk in read_interval_chunks(path, chunksize):
+        pyramid.update(chunk)
+    return pyramid